@@ -6,12 +6,124 @@ class Env(BaseSettings):
     DB_USER: str
     DB_PASS: str
     DB_NAME: str
-    FIREBASE_CONF: str
-    FIREBASE_STORAGE_BUCKET: str
+
+    DB_HOST: str = "127.0.0.1"
+    DB_PORT: int = 5432
+    DB_POOL_MIN_SIZE: int = 4
+    # per worker; serve.py lowers it so all workers fit in max_connections
+    DB_POOL_MAX_SIZE: int = 100
+    # connections are replaced after this many queries / seconds idle
+    DB_POOL_MAX_QUERIES: int = 50000
+    DB_POOL_MAX_IDLE: float = 300
+    DB_STATEMENT_CACHE_SIZE: int = 256
+    DB_COMMAND_TIMEOUT: float | None = None
+    DB_PREPARE_ON_CONNECT: bool = True
+
+    # admission control on the primary pool, see database.db.Postgres
+    DB_POOL_RESERVED_HIGH: int = 20
+    DB_MAX_WAITERS_HIGH: int = 500
+    DB_MAX_WAITERS_LOW: int = 50
+    DB_ACQUIRE_TIMEOUT_HIGH: float = 5
+    DB_ACQUIRE_TIMEOUT_LOW: float = 1
+    DB_RETRY_AFTER: int = 2
+
+    # comma separated host[:port] list of read replicas
+    DB_REPLICA_HOSTS: str = ""
+    DB_REPLICA_MAX_LAG: float = 30
+    DB_REPLICA_CHECK_INTERVAL: float = 5
+    DB_REPLICA_CHECK_TIMEOUT: float = 2
+    DB_READ_YOUR_WRITES_WINDOW: float = 10
+
+    # punch ingest: "direct" runs one transaction per request,
+    # "batched" groups punches into one transaction per flush
+    PUNCH_INGEST_MODE: str = "direct"
+    PUNCH_BATCH_SIZE: int = 256
+    PUNCH_BATCH_DELAY_MS: int = 5
+
+    # stale sessions: closed after SESSION_MAX_AGE seconds, swept every
+    # SESSION_AUTO_CLOSE_INTERVAL, SESSION_CLOSE_BATCH_SIZE rows per update
+    SESSION_AUTO_CLOSE: bool = True
+    SESSION_MAX_AGE: float = 12 * 3600
+    SESSION_AUTO_CLOSE_INTERVAL: float = 300
+    SESSION_CLOSE_BATCH_SIZE: int = 1000
+
+    # retention: closed sessions punched in more than SESSION_RETENTION_DAYS
+    # ago move to session_archive every SESSION_ARCHIVE_INTERVAL seconds,
+    # SESSION_ARCHIVE_BATCH_SIZE rows per transaction
+    SESSION_ARCHIVE: bool = True
+    SESSION_RETENTION_DAYS: int = 180
+    SESSION_ARCHIVE_INTERVAL: float = 3600
+    SESSION_ARCHIVE_BATCH_SIZE: int = 5000
+
+    DB_MIGRATE_ON_STARTUP: bool = True
+    SESSION_PARTITIONS_AHEAD: int = 3
+
+    # seconds a rollup rebuild waits for its table locks before giving up
+    ROLLUP_LOCK_TIMEOUT: float = 5
+
+    # occupancy streams: idle keep-alive every OCCUPANCY_HEARTBEAT seconds
+    OCCUPANCY_HEARTBEAT: float = 15
+    OCCUPANCY_RETRY_MS: int = 3000
+
+    VENUE_CACHE_SIZE: int = 4096
+    VENUE_CACHE_TTL: float = 300
+    VENUE_CACHE_NEGATIVE_TTL: float = 5
+
+    # heatmap and dwell results, cached per (venue or category, range)
+    ANALYTICS_CACHE_SIZE: int = 256
+    ANALYTICS_CACHE_TTL: float = 600
+
+    # firebase, local or memory, see lib.storage
+    STORAGE_BACKEND: str = "firebase"
+    FIREBASE_CONF: str = ""
+    FIREBASE_STORAGE_BUCKET: str = ""
+    STORAGE_LOCAL_DIR: str = "storage"
+    # prefix for local object urls; empty gives file:// urls
+    STORAGE_PUBLIC_URL: str = ""
+
+    UPLOAD_WORKERS: int = 8
+    UPLOAD_RETRIES: int = 3
+    UPLOAD_BACKOFF: float = 0.2
+
+    # 0 means one process per core
+    QR_RENDER_PROCESSES: int = 0
+    BULK_UPLOAD_CONCURRENCY: int = 16
+    BULK_VENUE_LIMIT: int = 5000
+
+    QR_ARTIFACT_DIR: str = "qr_image"
+    QR_ARTIFACT_CACHE_BYTES: int = 64 * 1024 * 1024
+
+    JWT_SECRET: str
+    JWT_ALGORITHM: str = "HS256"
+    ACCESS_TOKEN_TTL: int = 15 * 60
+    REFRESH_TOKEN_TTL: int = 30 * 24 * 3600
+    LAST_LOGIN_FLUSH_INTERVAL: float = 5
+    BULK_USER_LIMIT: int = 50000
+    # 0 means one process per core
+    PASSWORD_HASH_PROCESSES: int = 0
+
+    LOG_LEVEL: str = "INFO"
+
+    # production launcher, see serve.py
+    HOST: str = "0.0.0.0"
+    PORT: int = 8080
+    # 0 means one worker per available core
+    WORKERS: int = 0
+    # connections all workers together may hold; 0 reads max_connections from the server
+    DB_MAX_CONNECTIONS: int = 0
+    # kept out of the worker budget for migrations and admin sessions
+    DB_CONNECTIONS_RESERVED: int = 10
+    GRACEFUL_TIMEOUT: float = 30
+    KEEPALIVE_TIMEOUT: int = 5
+    ACCESS_LOG: bool = False
+
+    HEALTH_CHECK_TIMEOUT: float = 2
+    STORAGE_CHECK_INTERVAL: float = 30
+
     model_config = SettingsConfigDict(env_file=".env", extra="allow")
 
 @lru_cache
 def get_env():
     return Env()
 
-env: Env = get_env()
\ No newline at end of file
+env: Env = get_env()
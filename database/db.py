@@ -1,5 +1,17 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 import asyncpg
+from asyncpg import Connection, Pool
+from cachetools import TTLCache
+from fastapi import HTTPException
+
 from config import env
+from database.queries import prepare_all
+from lib import metrics
+from lib.log import logger
 
 tables = {
     "users": "users",
@@ -7,22 +19,296 @@ tables = {
     "venue": "venue",
 }
 
+# failures that mean the server is unreachable rather than the query being wrong
+UNAVAILABLE = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+               asyncpg.CannotConnectNowError)
+
+# punches and logins are HIGH, reporting, listing and provisioning are LOW
+HIGH = "high"
+LOW = "low"
+
+
+class Overloaded(HTTPException):
+    """No primary connection within the acquire budget; the request is shed."""
+
+    def __init__(self, priority: str):
+        super().__init__(503, detail={
+            "message": "service is overloaded, retry later",
+            "priority": priority,
+            "status": 503,
+        }, headers={"Retry-After": str(env.DB_RETRY_AFTER)})
+
+
+class Replica:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.pool: Pool | None = None
+        self.healthy = False
+        self.lag: float | None = None
+        self.reads = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
 class Postgres:
+    """
+    Connection pools for the primary and any read replicas.
+
+    `pool` is the primary and takes every write. `read()` hands out a
+    replica connection, round robin over replicas that passed their last
+    health check, and falls back to the primary when none is usable or
+    when the caller needs to read its own recent writes.
+
+    Primary connections are admitted by priority instead of queuing
+    without bound: LOW work may only hold max_size - DB_POOL_RESERVED_HIGH
+    connections, each priority has a cap on waiters and an acquire
+    timeout, and a request over either limit fails fast with `Overloaded`
+    (503 + Retry-After) rather than timing out in the client.
+    """
+
     def __init__(self):
         self.pool = None
+        self.replicas: list[Replica] = []
+        self.health_task: asyncio.Task | None = None
+        self.next_replica = 0
+        # users who wrote recently read from the primary for a while
+        self.recent_writers = TTLCache(maxsize=100_000, ttl=env.DB_READ_YOUR_WRITES_WINDOW)
+        self.low_slots = asyncio.Semaphore(max(1, env.DB_POOL_MAX_SIZE - env.DB_POOL_RESERVED_HIGH))
+        self.waiting = {HIGH: 0, LOW: 0}
+        self.limits = {
+            HIGH: (env.DB_MAX_WAITERS_HIGH, env.DB_ACQUIRE_TIMEOUT_HIGH),
+            LOW: (env.DB_MAX_WAITERS_LOW, env.DB_ACQUIRE_TIMEOUT_LOW),
+        }
+        self.acquire_wait = dict(count=0, total=0.0, max=0.0)
+        self.counters = dict(
+            primary_reads=0,
+            replica_reads=0,
+            read_your_writes=0,
+            replica_fallbacks=0,
+            writes=0,
+            shed_high=0,
+            shed_low=0,
+        )
 
     async def connect(self):
-        self.pool = await asyncpg.create_pool(
+        # min_size connections are opened, and their statements prepared,
+        # before the worker starts taking requests
+        self.pool = await self.create_pool(env.DB_HOST, env.DB_PORT)
+
+        for address in filter(None, env.DB_REPLICA_HOSTS.split(",")):
+            host, _, port = address.strip().partition(":")
+            self.replicas.append(Replica(host, int(port or env.DB_PORT)))
+
+        for replica in self.replicas:
+            await self.check(replica)
+
+        if self.replicas:
+            self.health_task = asyncio.create_task(self._health_loop())
+
+    @staticmethod
+    async def create_pool(host: str, port: int, reads_only: bool = False) -> Pool:
+        async def init(conn: Connection):
+            if env.DB_PREPARE_ON_CONNECT:
+                await prepare_all(conn, reads_only=reads_only)
+
+        async def setup(conn: Connection):
+            # on every acquire, not in init: the pool resets connections between uses
+            conn.add_query_logger(metrics.observe_query)
+
+        return await asyncpg.create_pool(
             user=env.DB_USER,
             password=env.DB_PASS,
-            host="127.0.0.1",
+            host=host,
+            port=port,
             database=env.DB_NAME,
-            min_size=1,
-            max_size=100
+            min_size=env.DB_POOL_MIN_SIZE,
+            max_size=env.DB_POOL_MAX_SIZE,
+            max_queries=env.DB_POOL_MAX_QUERIES,
+            max_inactive_connection_lifetime=env.DB_POOL_MAX_IDLE,
+            statement_cache_size=env.DB_STATEMENT_CACHE_SIZE,
+            command_timeout=env.DB_COMMAND_TIMEOUT,
+            init=init,
+            setup=setup,
+        )
+
+    async def check(self, replica: Replica):
+        try:
+            if replica.pool is None:
+                replica.pool = await self.create_pool(replica.host, replica.port, reads_only=True)
+
+            async with replica.pool.acquire(timeout=env.DB_REPLICA_CHECK_TIMEOUT) as conn:
+                row = await conn.fetchrow("""
+                    select pg_is_in_recovery() as standby,
+                           extract(epoch from now() - pg_last_xact_replay_timestamp()) as lag
+                """, timeout=env.DB_REPLICA_CHECK_TIMEOUT)
+
+            # time since the last replayed transaction; it overstates lag
+            # while the primary is idle, which only costs a primary fallback
+            # a host that isn't in recovery is not replicating, whatever its lag;
+            # a standby that hasn't replayed anything yet has no lag either
+            replica.lag = row['lag']
+            replica.healthy = row['standby'] and (row['lag'] is None or row['lag'] <= env.DB_REPLICA_MAX_LAG)
+            if not row['standby']:
+                logger.warning("replica %s is not a standby", replica.name)
+
+        except Exception as error:
+            logger.warning("replica %s failed its health check: %r", replica.name, error)
+            replica.healthy = False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(env.DB_REPLICA_CHECK_INTERVAL)
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    def mark_write(self, user_id: int):
+        self.recent_writers[user_id] = True
+
+    def choose_replica(self) -> Replica | None:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+
+        self.next_replica = (self.next_replica + 1) % len(healthy)
+        return healthy[self.next_replica]
+
+    async def acquire(self, priority: str = HIGH) -> Connection:
+        """Primary connection under the admission limits of `priority`."""
+        max_waiters, timeout = self.limits[priority]
+
+        if self.waiting[priority] >= max_waiters:
+            self.shed(priority)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.waiting[priority] += 1
+        slot = False
+
+        try:
+            if priority == LOW:
+                await asyncio.wait_for(self.low_slots.acquire(), timeout)
+                slot = True
+            remaining = max(0.001, timeout - (loop.time() - start))
+            conn = await self.pool.acquire(timeout=remaining)
+
+        except BaseException as error:
+            # a LOW slot is only kept together with a connection; cancelled
+            # waits and connection errors must give it back too
+            if slot:
+                self.low_slots.release()
+            if isinstance(error, asyncio.TimeoutError):
+                self.shed(priority)
+            raise
+
+        finally:
+            self.waiting[priority] -= 1
+
+        waited = loop.time() - start
+        self.acquire_wait['count'] += 1
+        self.acquire_wait['total'] += waited
+        self.acquire_wait['max'] = max(self.acquire_wait['max'], waited)
+        metrics.ACQUIRE_WAIT.labels("primary", priority).observe(waited)
+        return conn
+
+    def shed(self, priority: str):
+        self.counters[f'shed_{priority}'] += 1
+        metrics.SHED.labels(priority).inc()
+        raise Overloaded(priority)
+
+    async def release(self, conn: Connection, priority: str = HIGH):
+        try:
+            await self.pool.release(conn)
+        finally:
+            if priority == LOW:
+                self.low_slots.release()
+
+    @asynccontextmanager
+    async def write(self, priority: str = HIGH) -> AsyncIterator[Connection]:
+        """Connection on the primary for a write path."""
+        self.counters['writes'] += 1
+        conn = await self.acquire(priority)
+        try:
+            yield conn
+        finally:
+            await self.release(conn, priority)
+
+    @asynccontextmanager
+    async def read(
+        self, user_id: int = None, consistent: bool = False, priority: str = LOW
+    ) -> AsyncIterator[Connection]:
+        """
+        Connection for a read-only query. `consistent`, or a `user_id`
+        that wrote within DB_READ_YOUR_WRITES_WINDOW, pins it to the primary.
+        """
+        replica = None
+        if consistent or (user_id is not None and user_id in self.recent_writers):
+            self.counters['read_your_writes'] += 1
+        else:
+            replica = self.choose_replica()
+
+        conn = None
+        if replica is not None:
+            try:
+                start = time.perf_counter()
+                conn = await replica.pool.acquire(timeout=env.DB_REPLICA_CHECK_TIMEOUT)
+                metrics.ACQUIRE_WAIT.labels("replica", priority).observe(time.perf_counter() - start)
+                replica.reads += 1
+                self.counters['replica_reads'] += 1
+            except asyncio.TimeoutError:
+                # a busy pool, not a broken replica: only this read falls back
+                self.counters['replica_fallbacks'] += 1
+            except UNAVAILABLE:
+                replica.healthy = False
+                self.counters['replica_fallbacks'] += 1
+
+        if conn is not None:
+            try:
+                yield conn
+            finally:
+                await replica.pool.release(conn)
+            return
+
+        conn = await self.acquire(priority)
+        self.counters['primary_reads'] += 1
+        try:
+            yield conn
+        finally:
+            await self.release(conn, priority)
+
+    def stats(self) -> dict:
+        return dict(
+            **self.counters,
+            primary=dict(
+                size=self.pool.get_size(),
+                idle=self.pool.get_idle_size(),
+                waiting=dict(self.waiting),
+                acquire_wait=dict(self.acquire_wait),
+            ),
+            replicas=[
+                dict(
+                    name=replica.name,
+                    healthy=replica.healthy,
+                    lag=replica.lag,
+                    reads=replica.reads,
+                    size=replica.pool.get_size() if replica.pool else 0,
+                )
+                for replica in self.replicas
+            ],
         )
 
     async def disconnect(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+        self.replicas.clear()
+
         await self.pool.close()
 
 
-database = Postgres()
\ No newline at end of file
+database = Postgres()
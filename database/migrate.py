@@ -0,0 +1,155 @@
+"""
+Versioned schema migrations.
+
+Migrations are the numbered `.sql` files in `database/migrations`; each
+one is applied once, in its own transaction, and recorded in
+`schema_migrations`. Runs at startup (see `main.lifespan`) or by hand:
+
+    python -m database.migrate                 # migrate DB_NAME
+    python -m database.migrate --status        # list applied/pending versions
+    python -m database.migrate --scratch NAME  # create NAME and migrate it
+    python -m database.migrate --drop NAME     # drop a scratch database
+"""
+import argparse
+import asyncio
+from pathlib import Path
+
+import asyncpg
+from asyncpg import Connection
+
+from config import env
+from lib.log import logger, logs
+
+MIGRATIONS = Path(__file__).parent / "migrations"
+
+# arbitrary key so concurrent workers don't migrate at the same time
+LOCK_KEY = 727_001
+
+
+def load_migrations() -> list[tuple[int, str, str]]:
+    migrations = []
+    for path in sorted(MIGRATIONS.glob("*.sql")):
+        version = int(path.name.split("_", 1)[0])
+        migrations.append((version, path.name, path.read_text()))
+    return migrations
+
+
+async def applied_versions(conn: Connection) -> set[int]:
+    await conn.execute("""
+        create table if not exists schema_migrations (
+            version int primary key,
+            name text not null,
+            applied_at timestamptz not null default now()
+        )
+    """)
+    return {row['version'] for row in await conn.fetch("select version from schema_migrations")}
+
+
+async def migrate(conn: Connection) -> list[str]:
+    """Apply every pending migration, returns the names applied."""
+    applied = []
+
+    await conn.execute("select pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        done = await applied_versions(conn)
+
+        for version, name, sql in load_migrations():
+            if version in done:
+                continue
+
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "insert into schema_migrations (version, name) values ($1, $2)",
+                    version, name,
+                )
+            applied.append(name)
+            logger.info("migrate: applied %s", name)
+
+    finally:
+        await conn.execute("select pg_advisory_unlock($1)", LOCK_KEY)
+
+    return applied
+
+
+async def ensure_partitions(conn: Connection, months_ahead: int = 3):
+    """
+    Make sure session partitions exist for the coming months. Safe to run
+    from every worker at once, the function takes the migration lock.
+    """
+    await conn.execute("select ensure_session_partitions(0, $1)", months_ahead)
+
+
+async def connect(database: str = None) -> Connection:
+    return await asyncpg.connect(
+        user=env.DB_USER,
+        password=env.DB_PASS,
+        host=env.DB_HOST,
+        port=env.DB_PORT,
+        database=database or env.DB_NAME,
+    )
+
+
+async def create_scratch_database(name: str) -> str:
+    """Create an empty database `name` and migrate it, for tests and benchmarks."""
+    admin = await connect("postgres")
+    try:
+        await admin.execute(f'drop database if exists "{name}"')
+        await admin.execute(f'create database "{name}"')
+    finally:
+        await admin.close()
+
+    conn = await connect(name)
+    try:
+        await migrate(conn)
+    finally:
+        await conn.close()
+
+    return name
+
+
+async def drop_scratch_database(name: str):
+    admin = await connect("postgres")
+    try:
+        await admin.execute(f'drop database if exists "{name}" with (force)')
+    finally:
+        await admin.close()
+
+
+async def status(conn: Connection):
+    done = await applied_versions(conn)
+    for version, name, _ in load_migrations():
+        print(f"{'applied' if version in done else 'pending'}  {name}")
+
+
+async def main(args):
+    if args.drop:
+        await drop_scratch_database(args.drop)
+        return
+
+    if args.scratch:
+        await create_scratch_database(args.scratch)
+        return
+
+    conn = await connect()
+    try:
+        if args.status:
+            await status(conn)
+        else:
+            await migrate(conn)
+            await ensure_partitions(conn)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--status", action="store_true")
+    parser.add_argument("--scratch", metavar="NAME")
+    parser.add_argument("--drop", metavar="NAME")
+
+    logs.start(env.LOG_LEVEL)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        logs.stop()
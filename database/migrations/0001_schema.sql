@@ -0,0 +1,38 @@
+-- base schema; safe to run against a database created before migrations existed
+
+create table if not exists users (
+    id int primary key,
+    create_time timestamp not null default now(),
+    email text,
+    password text not null,
+    last_login timestamp,
+    phone bigint,
+    firstname text,
+    midname text,
+    lastname text,
+    role text
+);
+
+create table if not exists qr_code (
+    id text primary key,
+    url text not null
+);
+
+create table if not exists venue (
+    id int primary key,
+    name text,
+    qr_id text references qr_code (id),
+    category text not null,
+    number int
+);
+
+create table if not exists session (
+    id serial primary key,
+    description text,
+    user_id int not null,
+    venue_id int not null,
+    punch_in_time timestamp not null,
+    punch_out_time timestamp,
+    duration interval,
+    is_active boolean not null default true
+);
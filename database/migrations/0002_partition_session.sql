@@ -0,0 +1,70 @@
+-- range-partition session by month of punch_in_time
+
+create or replace function ensure_session_partitions(months_behind int, months_ahead int)
+returns void
+language plpgsql
+as $$
+declare
+    first_day date;
+    part_name text;
+begin
+    for i in -months_behind..months_ahead loop
+        first_day := (date_trunc('month', now()) + make_interval(months => i))::date;
+        part_name := format('session_%s', to_char(first_day, 'YYYY_MM'));
+
+        if to_regclass(part_name) is null then
+            execute format(
+                'create table %I partition of session for values from (%L) to (%L)',
+                part_name, first_day, (first_day + interval '1 month')::date
+            );
+        end if;
+    end loop;
+end;
+$$;
+
+do $$
+declare
+    oldest date;
+    months int;
+begin
+    if exists (
+        select 1 from pg_class
+        where oid = 'session'::regclass and relkind = 'p'
+    ) then
+        return;
+    end if;
+
+    alter table session rename to session_unpartitioned;
+    alter index if exists session_pkey rename to session_unpartitioned_pkey;
+    alter sequence session_id_seq owned by none;
+
+    create table session (
+        id int not null default nextval('session_id_seq'),
+        description text,
+        user_id int not null,
+        venue_id int not null,
+        punch_in_time timestamp not null,
+        punch_out_time timestamp,
+        duration interval,
+        is_active boolean not null default true,
+        primary key (id, punch_in_time)
+    ) partition by range (punch_in_time);
+
+    alter sequence session_id_seq owned by session.id;
+
+    create table session_default partition of session default;
+
+    -- one partition per month of existing history, plus the upcoming months
+    select coalesce(min(punch_in_time), now())::date into oldest from session_unpartitioned;
+    months := ((extract(year from now()) - extract(year from oldest)) * 12
+             + extract(month from now()) - extract(month from oldest))::int;
+    perform ensure_session_partitions(months, 3);
+
+    insert into session select
+        id, description, user_id, venue_id,
+        punch_in_time, punch_out_time, duration, is_active
+    from session_unpartitioned;
+
+    drop table session_unpartitioned;
+end;
+$$;
@@ -0,0 +1,23 @@
+-- indexes for the hot session queries; created on the partitioned parent
+-- so every current and future partition gets them
+
+-- listing: user_id = $1 and punch_in_time range, keyset on (punch_in_time, id)
+create index if not exists session_user_time
+    on session (user_id, punch_in_time, id);
+
+-- venue listing and export ranges
+create index if not exists session_venue_time
+    on session (venue_id, punch_in_time);
+
+create index if not exists session_time
+    on session (punch_in_time, id);
+
+-- duplicate punch check: user_id, venue_id and is_active = true
+create index if not exists session_active_user_venue
+    on session (user_id, venue_id)
+    where is_active;
+
+-- punch-out: id = $1 and is_active = true
+create index if not exists session_active_id
+    on session (id)
+    where is_active;
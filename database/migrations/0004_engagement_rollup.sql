@@ -0,0 +1,23 @@
+-- daily engagement totals maintained by lib/rollup.py
+
+create table if not exists user_engagement_daily (
+    user_id int not null,
+    day date not null,
+    category text not null,
+    sessions int not null default 0,
+    seconds bigint not null default 0,
+    primary key (user_id, day, category)
+);
+
+create table if not exists venue_engagement_daily (
+    venue_id int not null,
+    day date not null,
+    category text not null,
+    sessions int not null default 0,
+    visitors int not null default 0,
+    seconds bigint not null default 0,
+    primary key (venue_id, day)
+);
+
+create index if not exists venue_engagement_daily_category_day
+    on venue_engagement_daily (category, day);
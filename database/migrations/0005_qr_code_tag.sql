@@ -0,0 +1,8 @@
+-- keep the tag a qr_code id was hashed from, so artifacts can be re-rendered
+
+alter table qr_code add column if not exists tag text;
+
+update qr_code as q
+set tag = v.id || '_' || v.category || '_StudentEngagement'
+from venue as v
+where v.qr_id = q.id and q.tag is null;
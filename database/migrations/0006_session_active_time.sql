@@ -0,0 +1,5 @@
+-- bulk and automatic closing: active sessions, oldest punch-in first
+
+create index if not exists session_active_time
+    on session (punch_in_time)
+    where is_active;
@@ -0,0 +1,4 @@
+-- scans resolve an unknown tag by qr_code.id, joined back to its venue
+
+create index if not exists venue_qr_id
+    on venue (qr_id);
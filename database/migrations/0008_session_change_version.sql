@@ -0,0 +1,27 @@
+-- change version for delta sync: the id of the transaction that last
+-- inserted or updated the row. Transaction ids only grow, and every
+-- transaction below pg_snapshot_xmin has finished, so a reader that
+-- resumes from the xmin it saw can't miss a row that committed late.
+
+alter table session
+    add column if not exists change_version bigint not null
+    default (pg_current_xact_id()::text::bigint);
+
+create or replace function session_touch_change_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.change_version := pg_current_xact_id()::text::bigint;
+    return new;
+end;
+$$;
+
+drop trigger if exists session_change_version on session;
+create trigger session_change_version
+    before update on session
+    for each row execute function session_touch_change_version();
+
+-- sync: user_id = $1 and (change_version, id) > ($2, $3)
+create index if not exists session_user_change
+    on session (user_id, change_version, id);
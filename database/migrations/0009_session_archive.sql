@@ -0,0 +1,39 @@
+-- retention: lib/archive.py moves closed sessions punched in before the
+-- retention window here, so the hot session table stays the size of the
+-- window. Reads that may reach past it go through session_all.
+
+create table if not exists session_archive (
+    id int not null,
+    description text,
+    user_id int not null,
+    venue_id int not null,
+    punch_in_time timestamp not null,
+    punch_out_time timestamp,
+    duration interval,
+    is_active boolean not null default false,
+    change_version bigint not null,
+    primary key (id, punch_in_time)
+);
+
+-- the same access paths as the hot table, for the union branches
+create index if not exists session_archive_user_time
+    on session_archive (user_id, punch_in_time, id);
+
+create index if not exists session_archive_venue_time
+    on session_archive (venue_id, punch_in_time);
+
+create index if not exists session_archive_time
+    on session_archive (punch_in_time, id);
+
+create index if not exists session_archive_user_change
+    on session_archive (user_id, change_version, id);
+
+-- predicates and order by ... limit are pushed into both branches
+create or replace view session_all as
+    select id, description, user_id, venue_id, punch_in_time,
+           punch_out_time, duration, is_active, change_version
+    from session
+    union all
+    select id, description, user_id, venue_id, punch_in_time,
+           punch_out_time, duration, is_active, change_version
+    from session_archive;
@@ -0,0 +1,10 @@
+-- used refresh tokens and tokens revoked at logout, shared by every
+-- worker; rows are purged once the token would have expired anyway
+
+create table if not exists revoked_token (
+    jti text primary key,
+    expires_at timestamptz not null
+);
+
+create index if not exists revoked_token_expires
+    on revoked_token (expires_at);
@@ -0,0 +1,57 @@
+-- ensure_session_partitions runs in every worker at startup: serialize
+-- it, and move rows that landed in session_default for a month before
+-- that month's partition is created (create ... partition of fails
+-- when the default partition holds rows in its range)
+
+create or replace function ensure_session_partitions(months_behind int, months_ahead int)
+returns void
+language plpgsql
+as $$
+declare
+    first_day date;
+    last_day date;
+    part_name text;
+begin
+    -- same key as database.migrate.LOCK_KEY, released with the transaction
+    perform pg_advisory_xact_lock(727001);
+
+    for i in -months_behind..months_ahead loop
+        first_day := (date_trunc('month', now()) + make_interval(months => i))::date;
+        last_day := (first_day + interval '1 month')::date;
+        part_name := format('session_%s', to_char(first_day, 'YYYY_MM'));
+
+        if to_regclass(part_name) is not null then
+            continue;
+        end if;
+
+        if exists (
+            select 1 from session_default
+            where punch_in_time >= first_day and punch_in_time < last_day
+        ) then
+            execute format(
+                'create table %I (like session including defaults including constraints)',
+                part_name
+            );
+            execute format(
+                'with moved as (
+                    delete from session_default
+                    where punch_in_time >= %L and punch_in_time < %L
+                    returning *
+                )
+                insert into %I select * from moved',
+                first_day, last_day, part_name
+            );
+            execute format(
+                'alter table session attach partition %I for values from (%L) to (%L)',
+                part_name, first_day, last_day
+            );
+            raise notice 'moved rows of % out of session_default', part_name;
+        else
+            execute format(
+                'create table %I partition of session for values from (%L) to (%L)',
+                part_name, first_day, last_day
+            );
+        end if;
+    end loop;
+end;
+$$;
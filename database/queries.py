@@ -0,0 +1,431 @@
+"""
+Every static SQL statement the service runs, by name.
+
+asyncpg caches prepared statements per connection keyed by query text,
+so handlers that pass these constants reuse one server-side plan.
+`prepare_all` runs from the pool's `init` hook and puts the statements
+in `PREPARED` into that cache as soon as a connection is opened, before
+the first request needs them, and leaves no transaction open behind it. Queries assembled at runtime (listing and export
+filters) stay next to their handlers.
+"""
+import re
+
+from asyncpg import Connection, PostgresError
+
+from lib.log import logger
+from models.students import Session, Users, Venue
+
+# users
+
+USER_BY_ID = "select * from users where id = $1"
+
+USER_INSERT = """
+    insert into users (id, create_time, email, password, phone, role, firstname, midname, lastname)
+    values ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+"""
+
+# bulk onboarding: rows are COPYed into the staging table, then merged at once
+USERS_IMPORT_STAGE = """
+    create temporary table users_import (like users including defaults) on commit drop
+"""
+
+USERS_IMPORT_MERGE = """
+    insert into users (id, create_time, email, password, phone, role, firstname, midname, lastname)
+    select id, create_time, email, password, phone, role, firstname, midname, lastname
+    from users_import
+    on conflict (id) do nothing
+    returning id
+"""
+
+USERS_SET_LAST_LOGIN = """
+    update users as u
+    set last_login = p.last_login
+    from unnest($1::int[], $2::timestamp[]) as p(id, last_login)
+    where u.id = p.id
+"""
+
+# a refresh token is used once: no row back means it was used already
+TOKEN_REVOKE = """
+    with purge as (
+        delete from revoked_token where expires_at < now()
+    )
+    insert into revoked_token (jti, expires_at) values ($1, to_timestamp($2))
+    on conflict (jti) do nothing
+    returning jti
+"""
+
+# session
+
+SESSION_ACTIVE_FOR_PAIR = """
+    select * from session
+    where user_id = $1 and venue_id = $2 and is_active = true
+"""
+
+SESSION_INSERT = """
+    insert into session (description, user_id, venue_id, punch_in_time)
+    values ($1, $2, $3, $4) returning id
+"""
+
+SESSION_CLOSE = """
+    update session
+    set
+        punch_out_time = $1, duration = age($1, punch_in_time), is_active = false
+    where id = $2 and is_active = true
+    returning user_id, duration::text
+"""
+
+SESSION_DETAIL = """
+    select
+        s.id, s.description, s.user_id, s.venue_id, s.punch_in_time, s.punch_out_time, s.is_active,
+        s.change_version, v.category as venue_category
+    from session_all as s
+    inner join venue as v on s.venue_id = v.id
+    where s.id = $1
+"""
+
+# delta sync, see routes.session.sync_sessions. Archiving keeps
+# change_version, so archived rows only come back in a full sync
+SESSIONS_CHANGED = """
+    select id, description, user_id, venue_id, punch_in_time, punch_out_time,
+           duration::text, is_active, change_version
+    from session_all
+    where user_id = $1 and (change_version, id) > ($2, $3)
+    order by change_version, id
+    limit $4
+"""
+
+SNAPSHOT_HORIZON = "select pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+SESSIONS_ACTIVE = """
+    select id, user_id, venue_id, punch_in_time
+    from session
+    where is_active = true
+"""
+
+SESSIONS_ACTIVE_BY_USER = """
+    select id, user_id, venue_id, punch_in_time
+    from session
+    where user_id = $1 and is_active = true
+"""
+
+SESSIONS_ACTIVE_BY_VENUE = """
+    select id, user_id, venue_id, punch_in_time
+    from session
+    where venue_id = $1 and is_active = true
+"""
+
+SESSIONS_ACTIVE_FOR_PAIRS = """
+    select s.id, s.user_id, s.venue_id, s.punch_in_time
+    from session as s
+    inner join unnest($1::int[], $2::int[]) as p(user_id, venue_id)
+    on s.user_id = p.user_id and s.venue_id = p.venue_id
+    where s.is_active = true
+"""
+
+SESSIONS_INSERT_MANY = """
+    insert into session (description, user_id, venue_id, punch_in_time)
+    select * from unnest($1::text[], $2::int[], $3::int[], $4::timestamp[])
+    returning id, user_id, venue_id, punch_in_time
+"""
+
+SESSIONS_CLOSE_MANY = """
+    update session as s
+    set
+        punch_out_time = p.punch_out_time,
+        duration = age(p.punch_out_time, s.punch_in_time),
+        is_active = false
+    from unnest($1::int[], $2::timestamp[]) as p(id, punch_out_time)
+    where s.id = p.id and s.is_active = true
+    returning s.id, s.punch_out_time, s.duration::text
+"""
+
+# one chunk of a bulk close: active sessions punched in before $2, of
+# venue $1 or of every venue when it is null. punch_out_time is $4, or
+# punch_in_time + $5 when that is earlier (auto-close caps the duration).
+# skip locked leaves rows a punch-out is closing right now to that punch-out
+SESSIONS_CLOSE_BATCH = """
+    with batch as (
+        select id, punch_in_time
+        from session
+        where is_active = true and punch_in_time < $2
+          and ($1::int is null or venue_id = $1)
+        order by punch_in_time
+        limit $3
+        for update skip locked
+    )
+    update session as s
+    set
+        punch_out_time = least($4::timestamp, s.punch_in_time + $5::interval),
+        duration = age(least($4::timestamp, s.punch_in_time + $5::interval), s.punch_in_time),
+        is_active = false
+    from batch
+    where s.id = batch.id and s.punch_in_time = batch.punch_in_time
+    returning s.id, s.user_id, s.venue_id
+"""
+
+# retention, see lib.archive: one chunk of closed sessions punched in
+# before $1 moves to session_archive; delete and insert are one statement
+SESSIONS_ARCHIVE_BATCH = """
+    with batch as (
+        select id, punch_in_time
+        from session
+        where is_active = false and punch_in_time < $1
+        order by punch_in_time
+        limit $2
+        for update skip locked
+    ),
+    moved as (
+        delete from session as s
+        using batch
+        where s.id = batch.id and s.punch_in_time = batch.punch_in_time
+        returning s.id, s.description, s.user_id, s.venue_id, s.punch_in_time,
+                  s.punch_out_time, s.duration, s.is_active, s.change_version
+    ),
+    archived as (
+        insert into session_archive
+        select * from moved
+        returning punch_in_time
+    )
+    select count(*)::int as count, max(punch_in_time) as newest from archived
+"""
+
+SESSIONS_ARCHIVED_NEWEST = "select max(punch_in_time) from session_archive"
+
+NOTIFY_MANY = "select pg_notify($1, p) from unnest($2::text[]) as p"
+
+# venue and qr_code
+
+VENUE_BY_ID = "select * from venue where id = $1"
+
+VENUE_DETAIL = """
+    select v.category, v.id, qr.id as qr_id, qr.url
+    from venue as v
+    inner join qr_code as qr on v.qr_id = qr.id
+    where v.id = $1
+"""
+
+VENUE_TAGS = """
+    select v.id, v.category, qr.id as qr_id, qr.tag
+    from venue as v
+    inner join qr_code as qr on v.qr_id = qr.id
+    where qr.tag is not null
+"""
+
+VENUE_BY_QR_ID = """
+    select v.id, v.category, qr.id as qr_id, qr.tag
+    from venue as v
+    inner join qr_code as qr on v.qr_id = qr.id
+    where qr.id = $1
+"""
+
+VENUE_IDS_EXISTING = "select id from venue where id = any($1::int[])"
+
+VENUE_INSERT = """
+    insert into venue (id, qr_id, category) values ($1, $2, $3) returning *
+"""
+
+VENUES_INSERT_MANY = """
+    with qr as (
+        insert into qr_code (id, url, tag)
+        select * from unnest($1::text[], $2::text[], $5::text[])
+        on conflict (id) do update set url = excluded.url
+    )
+    insert into venue (id, qr_id, category)
+    select * from unnest($3::int[], $1::text[], $4::text[])
+    on conflict (id) do nothing
+    returning id
+"""
+
+QR_CODE_UPSERT = """
+    insert into qr_code (id, url, tag) values ($1, $2, $3)
+    on conflict (id) do update set url = excluded.url
+"""
+
+QR_CODE_TAG = "select tag from qr_code where id = $1"
+
+QR_CODE_URLS = "select id, url from qr_code where id = any($1::text[])"
+
+# engagement rollup
+
+ROLLUP_RECORD_USER = """
+    insert into user_engagement_daily as t (user_id, day, category, sessions, seconds)
+    select
+        s.user_id, s.punch_in_time::date, v.category,
+        count(*), sum(extract(epoch from s.duration))::bigint
+    from session as s
+    inner join venue as v on v.id = s.venue_id
+    where s.id = any($1::int[]) and s.is_active = false
+    group by s.user_id, s.punch_in_time::date, v.category
+    on conflict (user_id, day, category) do update
+    set
+        sessions = t.sessions + excluded.sessions,
+        seconds = t.seconds + excluded.seconds
+"""
+
+# a user already counted for the venue that day is not a new visitor
+ROLLUP_RECORD_VENUE = """
+    insert into venue_engagement_daily as t (venue_id, day, category, sessions, visitors, seconds)
+    select
+        s.venue_id, s.punch_in_time::date, v.category,
+        count(*),
+        count(distinct s.user_id) filter (
+            where not exists (
+                select 1 from session as p
+                where p.user_id = s.user_id and p.venue_id = s.venue_id
+                  and p.is_active = false and p.id <> all($1::int[])
+                  and p.punch_in_time::date = s.punch_in_time::date
+            )
+        ),
+        sum(extract(epoch from s.duration))::bigint
+    from session as s
+    inner join venue as v on v.id = s.venue_id
+    where s.id = any($1::int[]) and s.is_active = false
+    group by s.venue_id, s.punch_in_time::date, v.category
+    on conflict (venue_id, day) do update
+    set
+        sessions = t.sessions + excluded.sessions,
+        visitors = t.visitors + excluded.visitors,
+        seconds = t.seconds + excluded.seconds
+"""
+
+ROLLUP_REBUILD_USER = """
+    insert into user_engagement_daily (user_id, day, category, sessions, seconds)
+    select
+        s.user_id, s.punch_in_time::date, v.category,
+        count(*), sum(extract(epoch from s.duration))::bigint
+    from session_all as s
+    inner join venue as v on v.id = s.venue_id
+    where s.is_active = false
+    group by s.user_id, s.punch_in_time::date, v.category
+"""
+
+ROLLUP_REBUILD_VENUE = """
+    insert into venue_engagement_daily (venue_id, day, category, sessions, visitors, seconds)
+    select
+        s.venue_id, s.punch_in_time::date, v.category,
+        count(*), count(distinct s.user_id),
+        sum(extract(epoch from s.duration))::bigint
+    from session_all as s
+    inner join venue as v on v.id = s.venue_id
+    where s.is_active = false
+    group by s.venue_id, s.punch_in_time::date, v.category
+"""
+
+# reports
+
+REPORT_USER_BY_DAY = """
+    select day, sum(sessions)::int as sessions, sum(seconds)::bigint as seconds
+    from user_engagement_daily
+    where user_id = $1 and day >= $2 and day < $3
+    group by day
+    order by day
+"""
+
+REPORT_USER_BY_CATEGORY = """
+    select category, sum(sessions)::int as sessions, sum(seconds)::bigint as seconds
+    from user_engagement_daily
+    where user_id = $1 and day >= $2 and day < $3
+    group by category
+    order by seconds desc
+"""
+
+REPORT_VENUE_BY_DAY = """
+    select day, sessions, visitors, seconds
+    from venue_engagement_daily
+    where venue_id = $1 and day >= $2 and day < $3
+    order by day
+"""
+
+REPORT_CATEGORY_BY_DAY = """
+    select day, sum(sessions)::int as sessions, sum(seconds)::bigint as seconds
+    from venue_engagement_daily
+    where category = $1 and day >= $2 and day < $3
+    group by day
+    order by day
+"""
+
+REPORT_CATEGORY_BY_VENUE = """
+    select venue_id, sum(sessions)::int as sessions, sum(seconds)::bigint as seconds
+    from venue_engagement_daily
+    where category = $1 and day >= $2 and day < $3
+    group by venue_id
+    order by seconds desc
+"""
+
+PARAMETER = re.compile(r"\$(\d+)")
+
+# parsed on every new pool connection; asyncpg caches statements per
+# (query, record_class), so handlers passing record_class are listed with it
+PREPARED = (
+    (USER_BY_ID, Users),
+    (USERS_SET_LAST_LOGIN, None),
+    (TOKEN_REVOKE, None),
+    (SESSION_ACTIVE_FOR_PAIR, Session),
+    (SESSION_INSERT, Session),
+    (SESSION_CLOSE, Session),
+    (SESSION_DETAIL, Session),
+    (SESSIONS_CHANGED, Session),
+    (SNAPSHOT_HORIZON, None),
+    (SESSIONS_ACTIVE_BY_USER, None),
+    (SESSIONS_ACTIVE_BY_VENUE, None),
+    (SESSIONS_ACTIVE_FOR_PAIRS, None),
+    (SESSIONS_INSERT_MANY, None),
+    (SESSIONS_CLOSE_MANY, None),
+    (SESSIONS_CLOSE_BATCH, None),
+    (SESSIONS_ARCHIVE_BATCH, None),
+    (SESSIONS_ARCHIVED_NEWEST, None),
+    (NOTIFY_MANY, None),
+    (VENUE_BY_ID, Venue),
+    (VENUE_DETAIL, Venue),
+    (VENUE_BY_QR_ID, None),
+    (VENUE_IDS_EXISTING, None),
+    (VENUE_INSERT, Venue),
+    (QR_CODE_UPSERT, None),
+    (QR_CODE_TAG, None),
+    (QR_CODE_URLS, None),
+    (ROLLUP_RECORD_USER, None),
+    (ROLLUP_RECORD_VENUE, None),
+    (REPORT_USER_BY_DAY, None),
+    (REPORT_USER_BY_CATEGORY, None),
+    (REPORT_VENUE_BY_DAY, None),
+    (REPORT_CATEGORY_BY_DAY, None),
+    (REPORT_CATEGORY_BY_VENUE, None),
+)
+
+
+async def prepare_all(conn: Connection, reads_only: bool = False) -> int:
+    """
+    Fill the connection's statement cache by running every statement in
+    `PREPARED` once with NULL arguments, each in a savepoint of one
+    transaction that is rolled back: `fetch` parses through the cache
+    before it executes, and nothing it does is kept. (`Connection.prepare`
+    bypasses that cache, and an unsynced prepare would leave a transaction
+    open holding locks on every prepared table.) A statement whose tables
+    don't exist yet (fresh database, migrations pending) is skipped and
+    gets prepared on first use instead. Replicas only get the selects.
+    Returns how many statements were prepared.
+    """
+    prepared = 0
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        for stmt, record_class in PREPARED:
+            if reads_only and not stmt.lstrip().startswith("select"):
+                continue
+
+            args = [None] * max(map(int, PARAMETER.findall(stmt)), default=0)
+            try:
+                async with conn.transaction():
+                    await conn.fetch(stmt, *args, record_class=record_class)
+                prepared += 1
+            except PostgresError as error:
+                # class 42 fails the parse; anything else (a NULL in a not
+                # null column) fails after the statement was cached
+                if error.sqlstate.startswith("42"):
+                    logger.warning("statement not prepared: %s", error)
+                else:
+                    prepared += 1
+    finally:
+        await transaction.rollback()
+
+    return prepared
@@ -1,8 +1,26 @@
-import firebase_admin
-from firebase_admin import credentials, storage
+import threading
+
 from config import env
 
-cred = credentials.Certificate(env.FIREBASE_CONF)
-app = firebase_admin.initialize_app(cred)
+_lock = threading.Lock()
+_bucket = None
+
+
+def get_bucket():
+    """
+    The storage bucket, created on first use instead of at import so a
+    worker that never uploads never loads credentials. Called from upload
+    threads, hence the lock around the one-time setup.
+    """
+    global _bucket
+
+    with _lock:
+        if _bucket is None:
+            import firebase_admin
+            from firebase_admin import credentials, storage
+
+            cred = credentials.Certificate(env.FIREBASE_CONF)
+            app = firebase_admin.initialize_app(cred)
+            _bucket = storage.bucket(app=app, name=env.FIREBASE_STORAGE_BUCKET)
 
-firebase_bucket = storage.bucket(app=app, name=env.FIREBASE_STORAGE_BUCKET)
+    return _bucket
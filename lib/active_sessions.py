@@ -0,0 +1,236 @@
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from asyncpg import Connection
+
+from database import queries
+from database.db import database
+from lib.log import logger
+
+CHANNEL = "session_events"
+TOMBSTONES = 10_000
+RECONNECT_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+class ActiveSessions:
+    """
+    In-process index of sessions with is_active = true.
+
+    Loaded once at startup and kept coherent across workers through
+    LISTEN/NOTIFY on `session_events`: every write path calls `notify`
+    inside its transaction, so peers only see a punch after commit, and
+    `apply` once the transaction has committed. While the listener
+    connection is down `ready` is False and callers must fall back to
+    querying the session table; a background task reconnects and reloads
+    the index.
+
+    Because writers apply their own punches locally, the echo of a
+    punch-in can arrive after the matching punch-out; recently closed
+    ids are remembered so such a late echo is ignored.
+    """
+
+    def __init__(self):
+        self.by_id: dict[int, dict] = {}
+        self.by_pair: dict[tuple[int, int], dict] = {}
+        self.by_venue: dict[int, dict[int, dict]] = {}
+        self.by_user: dict[int, dict[int, dict]] = {}
+        self.closed: OrderedDict[int, None] = OrderedDict()
+        self.conn: Connection | None = None
+        self.ready = False
+        self.stopping = False
+        self.reconnect_task: asyncio.Task | None = None
+        # (op, session) notified during a load, None otherwise
+        self.pending: list | None = None
+        # called with (op, session) whenever the index changes, ("reload", None)
+        # after a load and ("unavailable", None) when it stops being kept up to date
+        self.listeners: list = []
+
+    async def start(self):
+        self.stopping = False
+        await self._connect()
+
+    async def _connect(self):
+        conn = await database.pool.acquire()
+        try:
+            conn.add_termination_listener(self._on_terminate)
+            await conn.add_listener(CHANNEL, self._on_notify)
+            self.conn = conn
+            await self.load()
+        except BaseException:
+            self.conn = None
+            conn.remove_termination_listener(self._on_terminate)
+            await database.pool.release(conn)
+            raise
+
+    async def stop(self):
+        self.stopping = True
+        self.ready = False
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+
+        if self.conn is None:
+            return
+
+        try:
+            await self.conn.remove_listener(CHANNEL, self._on_notify)
+            await database.pool.release(self.conn)
+        except Exception:
+            logger.exception("releasing the listener connection failed")
+
+        self.conn = None
+
+    async def load(self):
+        # notifications that arrive while the snapshot is read are replayed
+        # on top of it, so a punch committed meanwhile isn't lost
+        self.pending = []
+        try:
+            rows = await self.conn.fetch(queries.SESSIONS_ACTIVE)
+        finally:
+            pending, self.pending = self.pending, None
+
+        self.by_id.clear()
+        self.by_pair.clear()
+        self.by_venue.clear()
+        self.by_user.clear()
+
+        for row in rows:
+            self.add(dict(row), publish=False)
+        for op, session in pending:
+            self.apply(op, [session])
+
+        self.ready = True
+        self._publish("reload", None)
+
+    def get(self, user_id: int, venue_id: int) -> dict | None:
+        return self.by_pair.get((user_id, venue_id))
+
+    def get_by_id(self, session_id: int) -> dict | None:
+        return self.by_id.get(session_id)
+
+    def in_venue(self, venue_id: int) -> list[dict]:
+        return list(self.by_venue.get(venue_id, {}).values())
+
+    def count(self, venue_id: int) -> int:
+        return len(self.by_venue.get(venue_id, ()))
+
+    def of_user(self, user_id: int) -> list[dict]:
+        return list(self.by_user.get(user_id, {}).values())
+
+    def add(self, session: dict, publish: bool = True):
+        if session['id'] in self.closed:
+            return
+
+        # our own punch echoed back by NOTIFY is not a change
+        known = session['id'] in self.by_id
+        self.by_id[session['id']] = session
+        self.by_pair[(session['user_id'], session['venue_id'])] = session
+        self.by_venue.setdefault(session['venue_id'], {})[session['user_id']] = session
+        self.by_user.setdefault(session['user_id'], {})[session['venue_id']] = session
+
+        if publish and not known:
+            self._publish("in", session)
+
+    def remove(self, session_id: int) -> dict | None:
+        self.closed[session_id] = None
+        if len(self.closed) > TOMBSTONES:
+            self.closed.popitem(last=False)
+
+        session = self.by_id.pop(session_id, None)
+        if session is None:
+            return None
+
+        key = (session['user_id'], session['venue_id'])
+        if self.by_pair.get(key) is session:
+            del self.by_pair[key]
+
+        venue = self.by_venue.get(session['venue_id'], {})
+        if venue.get(session['user_id']) is session:
+            del venue[session['user_id']]
+            if not venue:
+                del self.by_venue[session['venue_id']]
+
+        user = self.by_user.get(session['user_id'], {})
+        if user.get(session['venue_id']) is session:
+            del user[session['venue_id']]
+            if not user:
+                del self.by_user[session['user_id']]
+
+        self._publish("out", session)
+        return session
+
+    def _publish(self, op: str, session: dict | None):
+        for listener in self.listeners:
+            listener(op, session)
+
+    @staticmethod
+    async def notify(conn: Connection, op: str, sessions: list[dict]):
+        """Queue `in`/`out` notifications on the caller's transaction."""
+        if not sessions:
+            return
+
+        payloads = [json.dumps(dict(op=op, **ActiveSessions._encode(s))) for s in sessions]
+        await conn.execute(queries.NOTIFY_MANY, CHANNEL, payloads)
+
+    def apply(self, op: str, sessions: list[dict]):
+        for session in sessions:
+            if op == "in":
+                self.add(session)
+            elif op == "out":
+                self.remove(session['id'])
+
+    @staticmethod
+    def _encode(session: dict) -> dict:
+        punch_in: datetime | None = session.get('punch_in_time')
+        return dict(
+            id=session['id'],
+            user_id=session.get('user_id'),
+            venue_id=session.get('venue_id'),
+            punch_in_time=punch_in.isoformat() if punch_in else None,
+        )
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        data = json.loads(payload)
+        op = data.pop('op')
+        if data['punch_in_time'] is not None:
+            data['punch_in_time'] = datetime.fromisoformat(data['punch_in_time'])
+        if self.pending is not None:
+            self.pending.append((op, data))
+            return
+        self.apply(op, [data])
+
+    def _on_terminate(self, conn):
+        # notifications are lost from here on, so stop trusting the index
+        self.ready = False
+        self.conn = None
+        self._publish("unavailable", None)
+
+        if not self.stopping:
+            self.reconnect_task = asyncio.get_running_loop().create_task(self._reconnect(conn))
+
+    async def _reconnect(self, dead: Connection):
+        # the pool replaces a closed connection once it is released
+        try:
+            await database.pool.release(dead)
+        except Exception:
+            logger.warning("releasing the dead listener connection failed", exc_info=True)
+
+        delay = RECONNECT_DELAY
+        while not self.stopping:
+            try:
+                await self._connect()
+                logger.info("active session index reconnected and reloaded")
+                break
+            except Exception:
+                logger.warning("active session index reconnect failed, retrying in %.0fs",
+                               delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        self.reconnect_task = None
+
+
+active_sessions = ActiveSessions()
@@ -0,0 +1,168 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+from asyncpg import Connection
+
+from config import env
+from database.db import database
+from lib.archive import session_archiver
+from lib.cache import AsyncCache
+
+HOUR = 3600
+DAY = 24 * HOUR
+EPOCH = datetime(1970, 1, 1)
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+DWELL_EDGES_MINUTES = (0, 5, 15, 30, 60, 120, 240, 480)
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+analytics_cache = AsyncCache(
+    maxsize=env.ANALYTICS_CACHE_SIZE,
+    ttl=env.ANALYTICS_CACHE_TTL,
+    negative_ttl=env.ANALYTICS_CACHE_TTL,
+)
+
+
+def epoch(t: datetime) -> float:
+    """Seconds since 1970 of a naive timestamp, the way extract(epoch) counts them."""
+    return (t - EPOCH).total_seconds()
+
+
+def build_query(source: str) -> str:
+    # one row of columns instead of a row per session; $1 reaches back
+    # SESSION_MAX_AGE before the range for sessions already in progress
+    return f"""
+        select
+            array_agg(extract(epoch from s.punch_in_time)::float8) as punch_in,
+            array_agg(extract(epoch from s.punch_out_time)::float8) as punch_out,
+            array_agg(v.category) as category
+        from {source} as s
+        inner join venue as v on v.id = s.venue_id
+        where s.punch_in_time >= $1 and s.punch_in_time < $2
+          and ($3::int is null or s.venue_id = $3)
+          and ($4::text is null or v.category = $4)
+    """
+
+
+def occupancy_curve(
+    punch_in: np.ndarray, punch_out: np.ndarray, start: float, end: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Average and peak number of people present in each hour of [start, end)."""
+    edges = np.arange(0, end - start + 1, HOUR, dtype=np.float64)
+    ins = np.sort(np.clip(punch_in - start, 0, edges[-1]))
+    outs = np.sort(np.clip(punch_out - start, 0, edges[-1]))
+
+    # time integral of occupancy up to t:
+    # sum(t - in for in < t) - sum(t - out for out < t)
+    n_in, n_out = np.searchsorted(ins, edges), np.searchsorted(outs, edges)
+    in_sums = np.concatenate(([0.0], np.cumsum(ins)))[n_in]
+    out_sums = np.concatenate(([0.0], np.cumsum(outs)))[n_out]
+    integral = edges * (n_in - n_out) - in_sums + out_sums
+    average = np.diff(integral) / HOUR
+
+    # people present at each hour start, raised by any higher level reached
+    # inside the hour; a punch-out sorts before a punch-in at the same time
+    peak = (np.searchsorted(ins, edges[:-1], side="right")
+            - np.searchsorted(outs, edges[:-1], side="right"))
+
+    times = np.concatenate((ins, outs))
+    deltas = np.concatenate((np.ones(len(ins), np.int64), -np.ones(len(outs), np.int64)))
+    order = np.lexsort((deltas, times))
+    times, level = times[order], np.cumsum(deltas[order])
+
+    bounds = np.searchsorted(times, edges)
+    busy = bounds[1:] > bounds[:-1]
+    if busy.any():
+        # every event between two busy starts belongs to the first one
+        highest = np.maximum.reduceat(level[:bounds[-1]], bounds[:-1][busy])
+        peak[busy] = np.maximum(peak[busy], highest)
+
+    return average, peak
+
+
+def heatmap(average: np.ndarray, peak: np.ndarray, start: float) -> dict:
+    """Fold hourly occupancy into weekday x hour-of-day cells."""
+    hours = start + HOUR * np.arange(len(average))
+    # 1970-01-01 was a Thursday
+    slot = (((hours // DAY + 3) % 7) * 24 + (hours % DAY) // HOUR).astype(np.int64)
+
+    counts = np.bincount(slot, minlength=7 * 24)
+    mean = np.bincount(slot, weights=average, minlength=7 * 24) / np.maximum(counts, 1)
+    highest = np.zeros(7 * 24, dtype=np.int64)
+    np.maximum.at(highest, slot, peak)
+
+    return dict(
+        days=DAYS,
+        average=np.round(mean, 2).reshape(7, 24).tolist(),
+        peak=highest.reshape(7, 24).tolist(),
+    )
+
+
+def dwell(minutes: np.ndarray) -> dict:
+    counts, _ = np.histogram(minutes, bins=(*DWELL_EDGES_MINUTES, np.inf))
+    edges = (*DWELL_EDGES_MINUTES, None)
+    histogram = [
+        dict(from_minutes=edges[i], to_minutes=edges[i + 1], sessions=int(count))
+        for i, count in enumerate(counts)
+    ]
+
+    if not len(minutes):
+        return dict(sessions=0, mean_minutes=None, percentiles=None, histogram=histogram)
+
+    return dict(
+        sessions=len(minutes),
+        mean_minutes=round(float(minutes.mean()), 1),
+        percentiles={
+            f"p{p}": round(float(value), 1)
+            for p, value in zip(PERCENTILES, np.percentile(minutes, PERCENTILES))
+        },
+        histogram=histogram,
+    )
+
+
+def analyze(row, start: float, end: float, now: float) -> dict:
+    punch_in = np.array(row['punch_in'] or [], dtype=np.float64)
+    # null punch-outs (active sessions) come back as nan
+    punch_out = np.array(row['punch_out'] or [], dtype=np.float64)
+    category = np.array(row['category'] or [], dtype=object)
+
+    closed = ~np.isnan(punch_out)
+    average, peak = occupancy_curve(punch_in, np.where(closed, punch_out, now), start, end)
+
+    # dwell only counts sessions punched in and closed within the range
+    counted = closed & (punch_in >= start)
+    minutes = (punch_out[counted] - punch_in[counted]) / 60
+    names, groups = np.unique(category[counted].astype(str), return_inverse=True)
+
+    return dict(
+        sessions=int(np.count_nonzero(punch_in >= start)),
+        heatmap=heatmap(average, peak, start),
+        curve=dict(
+            step_seconds=HOUR,
+            average=np.round(average, 2).tolist(),
+            peak=peak.tolist(),
+        ),
+        dwell=dwell(minutes),
+        categories={str(name): dwell(minutes[groups == i]) for i, name in enumerate(names)},
+    )
+
+
+async def load(venue_id: int | None, category: str | None, start: date, end: date) -> dict:
+    lower = datetime.combine(start, time.min)
+    upper = datetime.combine(end, time.min)
+    lookback = lower - timedelta(seconds=env.SESSION_MAX_AGE)
+
+    conn: Connection
+    async with database.read() as conn:
+        stmt = build_query(session_archiver.source(lookback))
+        row = await conn.fetchrow(stmt, lookback, upper, venue_id, category)
+
+    # numpy releases the GIL for most of this, keep it off the event loop
+    return await asyncio.to_thread(analyze, row, epoch(lower), epoch(upper), epoch(datetime.now()))
+
+
+async def get_analytics(venue_id: int | None, category: str | None, start: date, end: date) -> dict:
+    """Occupancy heatmap, hourly curve and dwell distribution, cached per range."""
+    key = (venue_id, category, start, end)
+    return await analytics_cache.get(key, lambda: load(venue_id, category, start, end))
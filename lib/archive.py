@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import LOW, database
+from lib.log import logger
+
+# arbitrary key, only one worker archives at a time
+ARCHIVE_LOCK = 727_003
+
+
+class SessionArchiver:
+    """
+    Keeps the session table the size of the retention window.
+
+    The background task started in the lifespan moves closed sessions
+    punched in more than `retention_days` ago to session_archive, one
+    DELETE ... RETURNING feeding an INSERT per chunk of `batch_size`
+    rows, each chunk in its own short transaction. Active sessions are
+    never moved, and a row is in exactly one of the two tables at any
+    snapshot.
+
+    Reads pick their table with `source`: the hot table when the range
+    starts inside the window, the session_all view (both tables) when it
+    may reach into the archive.
+    """
+
+    def __init__(self, batch_size: int = 5000, interval: float = 3600, retention_days: int = 180):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = timedelta(days=retention_days)
+        self.task: asyncio.Task | None = None
+        # newest punch-in in the archive, covers rows archived under a
+        # longer retention than the current one
+        self.newest: datetime | None = None
+        self.archived = 0
+
+    async def load(self):
+        conn: Connection
+        async with database.read(consistent=True) as conn:
+            self.newest = await conn.fetchval(queries.SESSIONS_ARCHIVED_NEWEST)
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def horizon(self) -> datetime | None:
+        """Sessions punched in before this may be archived."""
+        horizon = self.newest
+        if self.task is not None:
+            cutoff = datetime.now() - self.retention
+            horizon = cutoff if horizon is None else max(horizon, cutoff)
+        return horizon
+
+    def source(self, lower: datetime | None) -> str:
+        """The table to read sessions punched in from `lower` onwards from."""
+        horizon = self.horizon()
+        if horizon is None or (lower is not None and lower > horizon):
+            return "session"
+        return "session_all"
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                moved = await self.archive(datetime.now() - self.retention)
+                if moved:
+                    self.archived += moved
+                    logger.info("archived %d sessions", moved)
+                # another worker may have archived meanwhile
+                await self.load()
+            except Exception:
+                logger.exception("session archive failed")
+
+    async def archive(self, before: datetime) -> int:
+        """Move closed sessions punched in before `before`, returns how many."""
+        total = 0
+
+        while True:
+            moved = await self._archive_batch(before)
+            if moved is None:
+                break
+
+            total += moved
+            if moved < self.batch_size:
+                break
+
+        return total
+
+    async def _archive_batch(self, before: datetime) -> int | None:
+        conn: Connection
+        async with database.write(priority=LOW) as conn:
+            async with conn.transaction():
+                # another worker is archiving already
+                if not await conn.fetchval("select pg_try_advisory_xact_lock($1)", ARCHIVE_LOCK):
+                    return None
+
+                row = await conn.fetchrow(queries.SESSIONS_ARCHIVE_BATCH, before, self.batch_size)
+
+        if row['newest'] is not None and (self.newest is None or row['newest'] > self.newest):
+            self.newest = row['newest']
+
+        return row['count']
+
+    def stats(self) -> dict:
+        return dict(
+            retention_days=self.retention.days,
+            horizon=self.horizon(),
+            archived=self.archived,
+        )
+
+
+session_archiver = SessionArchiver(
+    batch_size=env.SESSION_ARCHIVE_BATCH_SIZE,
+    interval=env.SESSION_ARCHIVE_INTERVAL,
+    retention_days=env.SESSION_RETENTION_DAYS,
+)
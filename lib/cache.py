@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from cachetools import TTLCache
+
+from config import env
+
+MISSING = object()
+
+
+class AsyncCache:
+    """
+    Bounded LRU cache with a TTL for values loaded by coroutines.
+
+    Loaders returning None are cached for `negative_ttl` seconds so
+    unknown keys don't reach the database on every lookup. Concurrent
+    misses for one key share a single load. With `getsizeof` the bound
+    is on the summed size of the values instead of their count.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float, getsizeof: Callable = None):
+        self.values = TTLCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+        self.negative = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self.loading: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.values.get(key, MISSING)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        if key in self.negative:
+            self.negative_hits += 1
+            return None
+
+        task = self.loading.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self.loading[key] = task
+        else:
+            self.coalesced += 1
+
+        # a cancelled caller must not cancel the load others are waiting on
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+        finally:
+            # invalidated while loading: hand the value out but don't keep it
+            current = self.loading.get(key) is asyncio.current_task()
+            if current:
+                del self.loading[key]
+
+        if not current:
+            return value
+
+        if value is None:
+            self.negative[key] = True
+        else:
+            self.values[key] = value
+
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.negative.pop(key, None)
+        self.values[key] = value
+
+    def invalidate(self, key: Hashable):
+        self.values.pop(key, None)
+        self.negative.pop(key, None)
+        self.loading.pop(key, None)
+
+    def clear(self):
+        self.values.clear()
+        self.negative.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return dict(
+            size=len(self.values),
+            currsize=self.values.currsize,
+            maxsize=self.values.maxsize,
+            negative_size=len(self.negative),
+            hits=self.hits,
+            negative_hits=self.negative_hits,
+            misses=self.misses,
+            coalesced=self.coalesced,
+            hit_ratio=round((lookups - self.misses) / lookups, 4) if lookups else None,
+        )
+
+
+venue_cache = AsyncCache(
+    maxsize=env.VENUE_CACHE_SIZE,
+    ttl=env.VENUE_CACHE_TTL,
+    negative_ttl=env.VENUE_CACHE_NEGATIVE_TTL,
+)
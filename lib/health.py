@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+
+from config import env
+from database.db import database
+from lib.storage import get_storage
+
+
+class Health:
+    """
+    Liveness and readiness of one worker.
+
+    Live only says the event loop still answers. Ready means startup has
+    finished, the worker is not draining, the primary answers `select 1`
+    within HEALTH_CHECK_TIMEOUT and the storage backend passed its last
+    check; the storage result is reused for STORAGE_CHECK_INTERVAL so
+    probes don't turn into a storage request each.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.started = False
+        self.draining = False
+        # called once draining starts, e.g. to end long-lived streams
+        self.drain_listeners: list = []
+        self.storage: dict | None = None
+        self.storage_checked = 0.0
+
+    def drain(self):
+        """Stop reporting ready and tell long-lived streams to end."""
+        self.draining = True
+        for listener in self.drain_listeners:
+            listener()
+
+    def live(self) -> dict:
+        return dict(
+            status="ok",
+            pid=os.getpid(),
+            uptime=round(time.time() - self.started_at, 1),
+        )
+
+    async def check_database(self) -> dict:
+        if database.pool is None:
+            return dict(ok=False, error="pool not connected")
+
+        start = time.perf_counter()
+        try:
+            # straight from the pool: a probe must not be shed as LOW work
+            async with database.pool.acquire(timeout=env.HEALTH_CHECK_TIMEOUT) as conn:
+                await conn.fetchval("select 1", timeout=env.HEALTH_CHECK_TIMEOUT)
+        except Exception as error:
+            return dict(ok=False, error=repr(error))
+
+        return dict(
+            ok=True,
+            ms=round((time.perf_counter() - start) * 1000, 2),
+            size=database.pool.get_size(),
+            idle=database.pool.get_idle_size(),
+        )
+
+    async def check_storage(self) -> dict:
+        now = time.monotonic()
+        if self.storage is not None and now - self.storage_checked < env.STORAGE_CHECK_INTERVAL:
+            return self.storage
+
+        try:
+            storage = get_storage()
+            found = await asyncio.wait_for(asyncio.to_thread(storage.check), env.HEALTH_CHECK_TIMEOUT)
+            self.storage = dict(ok=True, backend=storage.name) if found else dict(
+                ok=False, backend=storage.name, error="storage check failed")
+        except Exception as error:
+            self.storage = dict(ok=False, error=repr(error))
+
+        self.storage_checked = now
+        return self.storage
+
+    async def ready(self) -> tuple[bool, dict]:
+        if not self.started or self.draining:
+            return False, dict(status="draining" if self.draining else "starting", pid=os.getpid())
+
+        db, storage = await asyncio.gather(self.check_database(), self.check_storage())
+        ok = db['ok'] and storage['ok']
+        return ok, dict(
+            status="ok" if ok else "unavailable",
+            pid=os.getpid(),
+            database=db,
+            storage=storage,
+        )
+
+
+health = Health()
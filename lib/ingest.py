@@ -0,0 +1,247 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import database
+from lib.active_sessions import active_sessions
+from lib.log import logger
+from lib.rollup import rollup
+
+# queued by `PunchBatcher.stop`, after the last event to flush
+STOP = object()
+
+
+@dataclass
+class PunchIn:
+    user_id: int
+    venue_id: int
+    description: str
+    punch_in_time: datetime = field(default_factory=datetime.now)
+    future: asyncio.Future = None
+
+
+@dataclass
+class PunchOut:
+    session_id: int
+    punch_out_time: datetime = field(default_factory=datetime.now)
+    future: asyncio.Future = None
+
+
+class PunchBatcher:
+    """
+    Group commit for punch events.
+
+    Punches are queued in process and flushed every `delay` seconds or
+    every `batch_size` events, whichever comes first. One flush uses one
+    pool connection and one transaction no matter how many punches it
+    carries; every caller still awaits its own result.
+    """
+
+    def __init__(self, batch_size: int = 256, delay: float = 0.005):
+        self.batch_size = batch_size
+        self.delay = delay
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.stopping = False
+        self.flushes = 0
+        self.events = 0
+
+    async def start(self):
+        self.stopping = False
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        # everything queued before the sentinel, and the batch being
+        # collected, is flushed before _run returns
+        self.stopping = True
+        await self.queue.put(STOP)
+        await self.task
+        self.task = None
+
+    async def punch_in(self, user_id: int, venue_id: int, description: str = "") -> dict:
+        event = PunchIn(user_id, venue_id, description)
+        return await self._submit(event)
+
+    async def punch_out(self, session_id: int) -> dict | None:
+        event = PunchOut(session_id)
+        return await self._submit(event)
+
+    async def _submit(self, event):
+        if self.task is None or self.stopping:
+            raise RuntimeError("punch batcher is not running")
+
+        event.future = asyncio.get_running_loop().create_future()
+        await self.queue.put(event)
+        return await event.future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            event = await self.queue.get()
+            if event is STOP:
+                break
+
+            batch = [event]
+            deadline = asyncio.get_running_loop().time() + self.delay
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        punch_ins = [e for e in batch if isinstance(e, PunchIn)]
+        punch_outs = [e for e in batch if isinstance(e, PunchOut)]
+
+        try:
+            conn: Connection
+            async with database.write() as conn:
+                async with conn.transaction():
+                    results = {}
+                    if punch_ins:
+                        results.update(await self._insert(conn, punch_ins))
+                    if punch_outs:
+                        results.update(await self._close(conn, punch_outs))
+
+                    opened = [
+                        dict(id=r['id'], user_id=r['user_id'], venue_id=r['venue_id'],
+                             punch_in_time=r['punch_in_time'])
+                        for r in results.values() if r is not None and r.get('created')
+                    ]
+                    closed = [
+                        dict(id=r['id'])
+                        for r in results.values() if r is not None and 'duration' in r
+                    ]
+                    await rollup.record(conn, [s['id'] for s in closed])
+                    await active_sessions.notify(conn, "in", opened)
+                    await active_sessions.notify(conn, "out", closed)
+
+        except Exception as error:
+            logger.exception("punch batch flush failed")
+            for event in batch:
+                if not event.future.done():
+                    event.future.set_exception(error)
+            return
+
+        active_sessions.apply("in", opened)
+        active_sessions.apply("out", closed)
+        for session in opened:
+            database.mark_write(session['user_id'])
+
+        self.flushes += 1
+        self.events += len(batch)
+
+        for event in batch:
+            if not event.future.done():
+                event.future.set_result(results.get(id(event)))
+
+    @staticmethod
+    async def _insert(conn: Connection, events: list[PunchIn]) -> dict:
+        results = {}
+
+        # first punch of a (user, venue) pair wins within the batch
+        unique: dict[tuple, PunchIn] = {}
+        for event in events:
+            unique.setdefault((event.user_id, event.venue_id), event)
+
+        users = [key[0] for key in unique]
+        venues = [key[1] for key in unique]
+
+        stmt = queries.SESSIONS_ACTIVE_FOR_PAIRS
+        active = {
+            (row['user_id'], row['venue_id']): row
+            for row in await conn.fetch(stmt, users, venues)
+        }
+
+        fresh = [event for key, event in unique.items() if key not in active]
+
+        inserted = {}
+        if fresh:
+            stmt = queries.SESSIONS_INSERT_MANY
+            rows = await conn.fetch(
+                stmt,
+                [e.description for e in fresh],
+                [e.user_id for e in fresh],
+                [e.venue_id for e in fresh],
+                [e.punch_in_time for e in fresh],
+            )
+            inserted = {(row['user_id'], row['venue_id']): row for row in rows}
+
+        for event in events:
+            key = (event.user_id, event.venue_id)
+            row = inserted.get(key)
+
+            if row is not None and unique[key] is event:
+                results[id(event)] = dict(
+                    id=row['id'],
+                    user_id=event.user_id,
+                    venue_id=event.venue_id,
+                    punch_in_time=row['punch_in_time'],
+                    is_active=True,
+                    created=True,
+                )
+            else:
+                row = active.get(key) or inserted.get(key)
+                results[id(event)] = dict(
+                    id=row['id'],
+                    user_id=event.user_id,
+                    venue_id=event.venue_id,
+                    punch_in_time=row['punch_in_time'],
+                    is_active=True,
+                    created=False,
+                )
+
+        return results
+
+    @staticmethod
+    async def _close(conn: Connection, events: list[PunchOut]) -> dict:
+        unique: dict[int, PunchOut] = {}
+        for event in events:
+            unique.setdefault(event.session_id, event)
+
+        stmt = queries.SESSIONS_CLOSE_MANY
+        rows = await conn.fetch(
+            stmt,
+            list(unique),
+            [e.punch_out_time for e in unique.values()],
+        )
+        closed = {row['id']: row for row in rows}
+
+        results = {}
+        for event in events:
+            row = closed.get(event.session_id)
+            if row is None or unique[event.session_id] is not event:
+                results[id(event)] = None
+                continue
+
+            results[id(event)] = dict(
+                id=event.session_id,
+                punch_out_time=row['punch_out_time'],
+                duration=row['duration'],
+            )
+
+        return results
+
+
+punch_batcher = PunchBatcher(
+    batch_size=env.PUNCH_BATCH_SIZE,
+    delay=env.PUNCH_BATCH_DELAY_MS / 1000,
+)
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import LOW, database
+from lib.log import logger
+
+
+class LastLoginWriter:
+    """
+    Coalesces `users.last_login` writes.
+
+    Logins only record the time in memory; a background task writes all
+    of them with one set-based UPDATE every `interval` seconds, so a
+    burst of logins costs one statement instead of one per login.
+    """
+
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self.pending: dict[int, datetime] = {}
+        self.task: asyncio.Task | None = None
+        self.stopping = asyncio.Event()
+
+    def record(self, user_id: int, date: datetime):
+        self.pending[user_id] = date
+
+    async def start(self):
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # not cancelled: a flush in progress finishes before the task
+        # returns, then whatever was recorded meanwhile is written here
+        if self.task is not None:
+            self.stopping.set()
+            await self.task
+            self.task = None
+
+        await self.flush()
+
+    async def _run(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("last_login flush failed")
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+
+        try:
+            conn: Connection
+            async with database.write(priority=LOW) as conn:
+                await conn.execute(queries.USERS_SET_LAST_LOGIN, list(pending), list(pending.values()))
+
+        except BaseException:
+            # keep them for the next flush unless a newer login replaced
+            # them, also when the flush is cancelled
+            for user_id, date in pending.items():
+                self.pending.setdefault(user_id, date)
+            raise
+
+
+last_login_writer = LastLoginWriter(interval=env.LAST_LOGIN_FLUSH_INTERVAL)
@@ -0,0 +1,66 @@
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger("engagement")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, and exc if any."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+        )
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread nearly as they are. The stock
+    QueueHandler formats the whole record in `prepare` (for queues that
+    pickle); here only the message is interpolated on the calling thread,
+    so later changes to the args can't alter it. JSON encoding, traceback
+    formatting and the write happen on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class Logging:
+    """Routes every logger through a queue to a single writer thread."""
+
+    def __init__(self):
+        self.listener: QueueListener | None = None
+
+    def start(self, level: str = "INFO"):
+        records = queue.SimpleQueue()
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter())
+
+        root = logging.getLogger()
+        root.handlers[:] = [LocalQueueHandler(records)]
+        root.setLevel(level)
+
+        self.listener = QueueListener(records, output, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            # drains what is queued before returning
+            self.listener.stop()
+            self.listener = None
+
+
+logs = Logging()
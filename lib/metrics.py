@@ -0,0 +1,109 @@
+"""
+Prometheus metrics for the hot paths, served by `GET /metrics`.
+
+- request latency per route template and in-flight requests (`MetricsMiddleware`)
+- time spent waiting for a pool connection (`database.db.Postgres.acquire`)
+- execution time per statement, labelled with its name in `database.queries`
+  (`observe_query`, installed on every pool connection)
+- pool size, idle and waiting connections, refreshed on scrape
+
+Each worker process exports its own series.
+"""
+import time
+
+from asyncpg.connection import LoggedQuery
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from database import queries
+
+# sub-millisecond to a few seconds; query and acquire times live down there
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ("method", "route", "status"),
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled")
+
+ACQUIRE_WAIT = Histogram(
+    "db_pool_acquire_seconds", "Time waiting for a pool connection",
+    ("pool", "priority"), buckets=FAST_BUCKETS,
+)
+SHED = Counter("db_pool_shed_total", "Requests refused a primary connection", ("priority",))
+
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Statement execution time",
+    ("statement",), buckets=FAST_BUCKETS,
+)
+QUERY_ERRORS = Counter("db_query_errors_total", "Statements that raised", ("statement",))
+
+POOL_SIZE = Gauge("db_pool_connections", "Open pool connections", ("pool",))
+POOL_IDLE = Gauge("db_pool_idle_connections", "Idle pool connections", ("pool",))
+POOL_WAITING = Gauge("db_pool_waiting", "Requests waiting for a primary connection", ("priority",))
+REPLICA_HEALTHY = Gauge("db_replica_healthy", "Replica passed its last health check", ("pool",))
+
+# label by constant name so dynamic SQL can't blow up the series count
+STATEMENTS = {
+    value: name.lower()
+    for name, value in vars(queries).items()
+    if name.isupper() and isinstance(value, str)
+}
+
+
+def observe_query(record: LoggedQuery):
+    statement = STATEMENTS.get(record.query, "dynamic")
+    QUERY_LATENCY.labels(statement).observe(record.elapsed)
+    if record.exception is not None:
+        QUERY_ERRORS.labels(statement).inc()
+
+
+def observe_pool(stats: dict):
+    primary = stats['primary']
+    POOL_SIZE.labels("primary").set(primary['size'])
+    POOL_IDLE.labels("primary").set(primary['idle'])
+    for priority, count in primary['waiting'].items():
+        POOL_WAITING.labels(priority).set(count)
+
+    for replica in stats['replicas']:
+        POOL_SIZE.labels(replica['name']).set(replica['size'])
+        REPLICA_HEALTHY.labels(replica['name']).set(int(replica['healthy']))
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (BaseHTTPMiddleware would wrap every response
+    body in another task). The route label is the matched path template,
+    read back from the scope after routing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status),
+            ).observe(time.perf_counter() - start)
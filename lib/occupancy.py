@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator
+
+from lib.active_sessions import active_sessions
+from lib.health import health
+
+QUEUE_SIZE = 256
+
+# tells a subscriber it missed events and needs a new snapshot
+RESYNC = object()
+# ends the stream: the worker is draining
+CLOSE = object()
+
+
+class Subscription:
+    def __init__(self, venue_id: int | None):
+        self.venue_id = venue_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a slow dashboard gets a snapshot instead of an ever growing backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(CLOSE if event is CLOSE else RESYNC)
+
+
+class OccupancyHub:
+    """
+    Pushes punch-in/punch-out events and occupancy counts to dashboards.
+
+    Fed by the active-session index whenever it changes, which covers
+    punches written by this worker and, through LISTEN/NOTIFY, by every
+    other worker, so each worker only fans out to its own subscribers.
+    Events are built once per change and queued per subscriber without
+    awaiting; subscribers to a venue get its events, subscribers to
+    `None` get every venue's. Subscribers are told when the index stops
+    being kept up to date, get a new snapshot once it is reloaded, and
+    their streams end when the worker starts draining.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[int | None, set[Subscription]] = {}
+        self.published = 0
+        self.closing = False
+        active_sessions.listeners.append(self.publish)
+        health.drain_listeners.append(self.close)
+
+    def subscribe(self, venue_id: int | None) -> Subscription:
+        subscription = Subscription(venue_id)
+        self.subscribers.setdefault(venue_id, set()).add(subscription)
+        if self.closing:
+            subscription.push(CLOSE)
+        return subscription
+
+    def _push_all(self, event):
+        for subscribers in self.subscribers.values():
+            for subscription in subscribers:
+                subscription.push(event)
+
+    def close(self):
+        """End every stream, so a graceful shutdown isn't held up by them."""
+        self.closing = True
+        self._push_all(CLOSE)
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscribers.get(subscription.venue_id, set())
+        subscribers.discard(subscription)
+        if not subscribers:
+            self.subscribers.pop(subscription.venue_id, None)
+
+    @staticmethod
+    def snapshot(venue_id: int | None) -> dict:
+        if venue_id is None:
+            return dict(
+                type="snapshot",
+                ready=active_sessions.ready,
+                venues={vid: len(users) for vid, users in active_sessions.by_venue.items()},
+            )
+
+        present = active_sessions.in_venue(venue_id)
+        return dict(
+            type="snapshot",
+            ready=active_sessions.ready,
+            venue_id=venue_id,
+            count=len(present),
+            present=[
+                dict(session_id=s['id'], user_id=s['user_id'], punch_in_time=s['punch_in_time'])
+                for s in present
+            ],
+        )
+
+    def publish(self, op: str, session: dict | None):
+        if op == "reload":
+            self._push_all(RESYNC)
+            return
+
+        if op == "unavailable":
+            # counts are frozen until the index is reloaded and a snapshot follows
+            self._push_all(dict(type="unavailable", ready=False))
+            return
+
+        venue_id = session['venue_id']
+        targets = self.subscribers.get(venue_id, set()) | self.subscribers.get(None, set())
+        if not targets:
+            return
+
+        event = dict(
+            type=op,
+            venue_id=venue_id,
+            user_id=session['user_id'],
+            session_id=session['id'],
+            time=session['punch_in_time'] if op == "in" else datetime.now(),
+            count=active_sessions.count(venue_id),
+        )
+        for subscription in targets:
+            subscription.push(event)
+        self.published += 1
+
+    async def events(self, subscription: Subscription, heartbeat: float) -> AsyncIterator[dict | None]:
+        """
+        Snapshot first, then events; None every `heartbeat` idle seconds.
+        Ends with a `close` event when the worker starts draining.
+        """
+        yield self.snapshot(subscription.venue_id)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+
+            if event is CLOSE:
+                yield dict(type="close")
+                return
+
+            yield self.snapshot(subscription.venue_id) if event is RESYNC else event
+
+    def stats(self) -> dict:
+        return dict(
+            subscribers=sum(len(s) for s in self.subscribers.values()),
+            venues=len(self.subscribers),
+            published=self.published,
+        )
+
+
+occupancy = OccupancyHub()
@@ -0,0 +1,44 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
+from config import env
+
+# passwords per task: small enough to spread over every process, large
+# enough that pickling a chunk costs less than hashing it
+CHUNK_SIZE = 500
+
+hash_pool: ProcessPoolExecutor | None = None
+
+
+def hash_password(password: str) -> str:
+    """The hash stored in `users.password`."""
+    return sha256(password.encode('utf-8')).hexdigest()
+
+
+def _hash_chunk(passwords: list[str]) -> list[str]:
+    return [hash_password(password) for password in passwords]
+
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hash many passwords across a process pool, in order."""
+    if len(passwords) <= CHUNK_SIZE:
+        return _hash_chunk(passwords)
+
+    global hash_pool
+    if hash_pool is None:
+        hash_pool = ProcessPoolExecutor(max_workers=env.PASSWORD_HASH_PROCESSES or None)
+
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(hash_pool, _hash_chunk, passwords[i:i + CHUNK_SIZE])
+        for i in range(0, len(passwords), CHUNK_SIZE)
+    ))
+    return [digest for chunk in chunks for digest in chunk]
+
+
+def shutdown_hash_pool():
+    global hash_pool
+    if hash_pool is not None:
+        hash_pool.shutdown(cancel_futures=True)
+        hash_pool = None
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from pathlib import Path
+
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import database
+from lib.cache import AsyncCache
+from lib.qrcode import render_variant
+
+KINDS = ("png", "svg")
+
+
+class QRArtifactStore:
+    """
+    Content-addressed QR images, keyed by `qr_code.id` (sha1 of the tag).
+
+    A variant (kind, scale) is rendered at most once per worker: it is
+    kept in a size-bounded memory cache and written to `root` on disk,
+    which every worker on the host shares. Since the key is a hash of the
+    content an artifact never changes and can be cached forever.
+    """
+
+    def __init__(self, root: str, cache_bytes: int):
+        self.root = Path(root)
+        self.cache = AsyncCache(maxsize=cache_bytes, ttl=24 * 3600, negative_ttl=5, getsizeof=len)
+        self.tags = AsyncCache(maxsize=65536, ttl=24 * 3600, negative_ttl=5)
+        self.renders = 0
+
+    async def get(self, qr_id: str, kind: str = "png", scale: int = 10) -> bytes | None:
+        return await self.cache.get((qr_id, kind, scale), lambda: self._load(qr_id, kind, scale))
+
+    async def put(self, qr_id: str, tag: str, data: bytes, kind: str = "png", scale: int = 10):
+        """Keep an artifact rendered elsewhere, e.g. while creating a venue."""
+        self.tags.set(qr_id, tag)
+        self.cache.set((qr_id, kind, scale), data)
+        await asyncio.to_thread(self._write, self.root / f"{qr_id}_{scale}.{kind}", data)
+
+    async def tag_of(self, qr_id: str) -> str | None:
+        return await self.tags.get(qr_id, lambda: self._fetch_tag(qr_id))
+
+    async def _load(self, qr_id: str, kind: str, scale: int) -> bytes | None:
+        path = self.root / f"{qr_id}_{scale}.{kind}"
+
+        data = await asyncio.to_thread(self._read, path)
+        if data is not None:
+            return data
+
+        tag = await self.tag_of(qr_id)
+        if tag is None:
+            return None
+
+        data = await asyncio.to_thread(render_variant, tag, kind, scale)
+        self.renders += 1
+        await asyncio.to_thread(self._write, path, data)
+        return data
+
+    @staticmethod
+    async def _fetch_tag(qr_id: str) -> str | None:
+        conn: Connection
+        async with database.read() as conn:
+            return await conn.fetchval(queries.QR_CODE_TAG, qr_id)
+
+    @staticmethod
+    def _read(path: Path) -> bytes | None:
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename so a concurrent reader never sees half a file
+        partial = path.with_suffix(f"{path.suffix}.{os.getpid()}.part")
+        partial.write_bytes(data)
+        partial.replace(path)
+
+    async def existing_urls(self, qr_ids: list[str]) -> dict[str, str]:
+        """Storage urls of artifacts already uploaded, so callers can skip the upload."""
+        conn: Connection
+        async with database.read() as conn:
+            rows = await conn.fetch(queries.QR_CODE_URLS, qr_ids)
+
+        return {row['id']: row['url'] for row in rows}
+
+    def stats(self) -> dict:
+        return dict(renders=self.renders, **self.cache.stats())
+
+
+qr_store = QRArtifactStore(root=env.QR_ARTIFACT_DIR, cache_bytes=env.QR_ARTIFACT_CACHE_BYTES)
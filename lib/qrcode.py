@@ -1,12 +1,37 @@
+import asyncio
 import io
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
 from io import FileIO, BytesIO
 
 import segno
 from segno import QRCode
 
-def generate_qr_code(number: str, category: str):
+from config import env
+
+render_pool: ProcessPoolExecutor | None = None
+
+def make_tag(number: str, category: str) -> str:
     data: list = [number, category, "StudentEngagement"]
-    tag: str = "_".join(data)
+    return "_".join(data)
+
+
+def qr_id_of(tag: str) -> str:
+    """Content address of a QR artifact, the `qr_code.id` of its tag."""
+    return sha1(tag.encode('utf-8')).hexdigest()
+
+
+def render_variant(tag: str, kind: str = "png", scale: int = 10) -> bytes:
+    img: QRCode = segno.make(tag, micro=False)
+
+    file = BytesIO()
+    img.save(file, kind=kind, scale=scale)
+
+    return file.getvalue()
+
+
+def generate_qr_code(number: str, category: str):
+    tag: str = make_tag(number, category)
 
     img: QRCode = segno.make(tag, micro=False)
 
@@ -15,3 +40,40 @@ def generate_qr_code(number: str, category: str):
 
     return file, tag
 
+
+async def render_qr_code(number: str, category: str):
+    """`generate_qr_code` on a worker thread so rendering never blocks the event loop."""
+    return await asyncio.to_thread(generate_qr_code, number, category)
+
+
+def _render_png(number: str, category: str) -> tuple[bytes, str]:
+    file, tag = generate_qr_code(number, category)
+    return file.getvalue(), tag
+
+
+async def render_qr_codes(items: list[tuple[str, str]]) -> list[tuple[BytesIO, str] | Exception]:
+    """
+    Render many (number, category) QR codes across a process pool, in
+    order. A failed render is returned as its exception.
+    """
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=env.QR_RENDER_PROCESSES or None)
+
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(render_pool, _render_png, number, category) for number, category in items),
+        return_exceptions=True,
+    )
+
+    return [
+        result if isinstance(result, Exception) else (BytesIO(result[0]), result[1])
+        for result in results
+    ]
+
+
+def shutdown_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+        render_pool = None
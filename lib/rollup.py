@@ -0,0 +1,59 @@
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import LOW, database
+
+
+class EngagementRollup:
+    """
+    Daily engagement totals per user and per venue, stored in the
+    tables created by migration 0004.
+
+    Totals are keyed by the day a session was punched in and only count
+    closed sessions. `record` is called from the punch-out write path in
+    the same transaction as the close, `rebuild` recomputes every total
+    from every session, archived ones included.
+
+    `rebuild` locks both tables; while its lock request waits, every
+    punch-out queues behind it, so it waits at most `lock_timeout`
+    seconds and raises LockNotAvailableError instead.
+    """
+
+    def __init__(self, lock_timeout: float = 5):
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    async def record(conn: Connection, session_ids: list[int]):
+        if not session_ids:
+            return
+
+        await conn.execute(queries.ROLLUP_RECORD_USER, session_ids)
+        await conn.execute(queries.ROLLUP_RECORD_VENUE, session_ids)
+
+    async def rebuild(self) -> dict:
+        conn: Connection
+        async with database.write(priority=LOW) as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "select set_config('lock_timeout', $1, true)",
+                    f"{int(self.lock_timeout * 1000)}ms",
+                )
+                await conn.execute("""
+                    lock table user_engagement_daily, venue_engagement_daily
+                    in exclusive mode
+                """)
+                await conn.execute("truncate user_engagement_daily, venue_engagement_daily")
+                # the locks are held now; the rebuild itself may take a while
+                await conn.execute("select set_config('lock_timeout', '0', true)")
+
+                users = await conn.execute(queries.ROLLUP_REBUILD_USER)
+                venues = await conn.execute(queries.ROLLUP_REBUILD_VENUE)
+
+        return dict(
+            user_rows=int(users.split()[-1]),
+            venue_rows=int(venues.split()[-1]),
+        )
+
+
+rollup = EngagementRollup(lock_timeout=env.ROLLUP_LOCK_TIMEOUT)
@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from asyncpg import Connection
+
+from config import env
+from database import queries
+from database.db import LOW, database
+from lib.active_sessions import active_sessions
+from lib.log import logger
+from lib.rollup import rollup
+
+# arbitrary key, only one worker sweeps at a time
+SWEEP_LOCK = 727_002
+
+
+class SessionCloser:
+    """
+    Closes active sessions in bulk, one set-based UPDATE per chunk of
+    `batch_size` rows, each chunk in its own short transaction so a large
+    close never holds many row locks or one long transaction.
+
+    `close` serves the bulk close API (by venue, or everyone at the end
+    of the day). The background task started in the lifespan closes
+    sessions punched in more than `max_age` ago, with the punch-out set to
+    punch-in + `max_age` so a forgotten punch-out doesn't count as hours
+    on campus.
+    """
+
+    def __init__(self, batch_size: int = 1000, interval: float = 300, max_age: float = 12 * 3600):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_age = timedelta(seconds=max_age)
+        self.task: asyncio.Task | None = None
+        self.auto_closed = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                closed = await self.close(
+                    before=datetime.now() - self.max_age, cap=self.max_age, sweep=True
+                )
+                if closed:
+                    self.auto_closed += closed
+                    logger.info("auto-closed %d stale sessions", closed)
+            except Exception:
+                logger.exception("stale session sweep failed")
+
+    async def close(
+        self, venue_id: int = None, before: datetime = None,
+        cap: timedelta = None, sweep: bool = False,
+    ) -> int:
+        """
+        Close active sessions punched in before `before` (default now), of
+        `venue_id` or of every venue. Returns how many were closed.
+        """
+        before = before or datetime.now()
+        total = 0
+
+        while True:
+            closed = await self._close_batch(venue_id, before, cap, sweep)
+            if closed is None:
+                break
+
+            total += closed
+            if closed < self.batch_size:
+                break
+
+        return total
+
+    async def _close_batch(self, venue_id, before, cap, sweep) -> int | None:
+        conn: Connection
+        async with database.write(priority=LOW) as conn:
+            async with conn.transaction():
+                # another worker is sweeping already
+                if sweep and not await conn.fetchval("select pg_try_advisory_xact_lock($1)", SWEEP_LOCK):
+                    return None
+
+                rows = await conn.fetch(
+                    queries.SESSIONS_CLOSE_BATCH,
+                    venue_id, before, self.batch_size, datetime.now(), cap,
+                )
+                ids = [row['id'] for row in rows]
+                await rollup.record(conn, ids)
+                await active_sessions.notify(conn, "out", [dict(id=id) for id in ids])
+
+        active_sessions.apply("out", [dict(id=id) for id in ids])
+        for user_id in {row['user_id'] for row in rows}:
+            database.mark_write(user_id)
+
+        return len(rows)
+
+
+session_closer = SessionCloser(
+    batch_size=env.SESSION_CLOSE_BATCH_SIZE,
+    interval=env.SESSION_AUTO_CLOSE_INTERVAL,
+    max_age=env.SESSION_MAX_AGE,
+)
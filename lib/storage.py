@@ -0,0 +1,119 @@
+"""
+Object storage for QR images, chosen by STORAGE_BACKEND:
+
+    firebase  the Firebase bucket from FIREBASE_CONF / FIREBASE_STORAGE_BUCKET
+    local     files under STORAGE_LOCAL_DIR, urls under STORAGE_PUBLIC_URL
+    memory    a dict, for benchmarks and offline runs
+
+Backends are blocking and are called from the upload threads in
+`lib.upload`. Objects are named after the QR content hash
+(`<qr_id>.png`), never after user input. Nothing is set up until
+`get_storage()` is first called, and the Firebase client not until the
+first upload.
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+from pathlib import Path
+
+from config import env
+
+
+class Storage(ABC):
+    name = "storage"
+
+    @abstractmethod
+    def put(self, name: str, file: BytesIO, content_type: str) -> str:
+        """Store `file` as a public object `name` and return its url."""
+
+    @abstractmethod
+    def check(self) -> bool:
+        """Whether the backend can take uploads right now."""
+
+
+class FirebaseStorage(Storage):
+    name = "firebase"
+
+    def put(self, name: str, file: BytesIO, content_type: str) -> str:
+        from firebase.firebase import get_bucket
+
+        blob = get_bucket().blob(name)
+        blob.upload_from_file(file, content_type=content_type, rewind=True)
+        blob.make_public()
+        return blob.public_url
+
+    def check(self) -> bool:
+        from firebase.firebase import get_bucket
+
+        return get_bucket().exists()
+
+
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(self, root: str, public_url: str = ""):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.root = self.root.resolve()
+        self.public_url = public_url.rstrip("/")
+
+    def put(self, name: str, file: BytesIO, content_type: str) -> str:
+        path = (self.root / name).resolve()
+        if path.parent != self.root:
+            raise ValueError(f"object name {name!r} must be a plain file name")
+
+        file.seek(0)
+        part = path.with_name(f".{path.name}.{os.getpid()}.part")
+        part.write_bytes(file.read())
+        os.replace(part, path)
+        return f"{self.public_url}/{name}" if self.public_url else path.resolve().as_uri()
+
+    def check(self) -> bool:
+        return os.access(self.root, os.W_OK)
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str]] = {}
+
+    def put(self, name: str, file: BytesIO, content_type: str) -> str:
+        file.seek(0)
+        self.objects[name] = (file.read(), content_type)
+        return f"memory://{name}"
+
+    def check(self) -> bool:
+        return True
+
+
+BACKENDS = {
+    "firebase": FirebaseStorage,
+    "local": lambda: LocalStorage(env.STORAGE_LOCAL_DIR, env.STORAGE_PUBLIC_URL),
+    "memory": MemoryStorage,
+}
+
+_lock = threading.Lock()
+_storage: Storage | None = None
+
+
+def get_storage() -> Storage:
+    global _storage
+
+    with _lock:
+        if _storage is None:
+            if env.STORAGE_BACKEND not in BACKENDS:
+                raise ValueError(f"unknown STORAGE_BACKEND {env.STORAGE_BACKEND!r}, "
+                                 f"expected one of {', '.join(BACKENDS)}")
+            _storage = BACKENDS[env.STORAGE_BACKEND]()
+
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """Use `storage` instead of the configured backend, e.g. in benchmarks."""
+    global _storage
+
+    with _lock:
+        _storage = storage
@@ -0,0 +1,60 @@
+from asyncpg import Connection
+from cachetools import TTLCache
+
+from config import env
+from database import queries
+from database.db import database
+from lib.qrcode import qr_id_of
+
+
+class VenueTagIndex:
+    """
+    QR tag -> venue, so a scan resolves its venue without a query.
+
+    Loaded at startup from venue/qr_code and updated by the venue routes
+    of this worker. A tag it doesn't know (a venue created on another
+    worker) is looked up once by its content address, `qr_code.id =
+    sha1(tag)`, and added; unknown tags are remembered for
+    VENUE_CACHE_NEGATIVE_TTL so a bad scan can't hit the database in a loop.
+    """
+
+    def __init__(self):
+        self.by_tag: dict[str, dict] = {}
+        self.missing = TTLCache(maxsize=10_000, ttl=env.VENUE_CACHE_NEGATIVE_TTL)
+
+    async def load(self):
+        conn: Connection
+        async with database.read() as conn:
+            rows = await conn.fetch(queries.VENUE_TAGS)
+
+        self.by_tag = {
+            row['tag']: dict(id=row['id'], category=row['category'], qr_id=row['qr_id'])
+            for row in rows
+        }
+
+    def add(self, tag: str, venue_id: int, category: str, qr_id: str):
+        self.by_tag[tag] = dict(id=venue_id, category=category, qr_id=qr_id)
+        self.missing.pop(tag, None)
+
+    async def resolve(self, tag: str) -> dict | None:
+        venue = self.by_tag.get(tag)
+        if venue is not None or tag in self.missing:
+            return venue
+
+        # primary: the venue may have been created a moment ago
+        conn: Connection
+        async with database.read(consistent=True) as conn:
+            row = await conn.fetchrow(queries.VENUE_BY_QR_ID, qr_id_of(tag))
+
+        if row is None or row['tag'] != tag:
+            self.missing[tag] = True
+            return None
+
+        self.add(tag, row['id'], row['category'], row['qr_id'])
+        return self.by_tag[tag]
+
+    def stats(self) -> dict:
+        return dict(tags=len(self.by_tag), missing=len(self.missing))
+
+
+tag_index = VenueTagIndex()
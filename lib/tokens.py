@@ -0,0 +1,120 @@
+import time
+import uuid
+from typing import Annotated
+
+import jwt
+from asyncpg import Connection
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from config import env
+from database import queries
+from database.db import database
+
+bearer = HTTPBearer(auto_error=False)
+
+
+class RevocationList:
+    """
+    Token ids revoked before their expiry, e.g. on logout.
+
+    Refresh tokens are single use across every worker and restart:
+    `consume` records them in the revoked_token table, and only the first
+    caller to insert a jti gets to use it. Access tokens are checked on
+    every request without a query, so their revocations are kept per
+    worker only; they are short-lived enough that a logout seen by one
+    worker is acceptable. Entries are dropped once the token would have
+    expired anyway.
+    """
+
+    def __init__(self):
+        self.revoked: dict[str, float] = {}
+
+    def revoke(self, jti: str, exp: float):
+        self.revoked[jti] = exp
+        self.purge()
+
+    async def consume(self, jti: str, exp: float) -> bool:
+        """Revoke a refresh token everywhere; False if it was revoked already."""
+        self.revoke(jti, exp)
+
+        conn: Connection
+        async with database.write() as conn:
+            return await conn.fetchval(queries.TOKEN_REVOKE, jti, float(exp)) is not None
+
+    def is_revoked(self, jti: str) -> bool:
+        exp = self.revoked.get(jti)
+        return exp is not None and exp > time.time()
+
+    def purge(self):
+        now = time.time()
+        for jti in [jti for jti, exp in self.revoked.items() if exp <= now]:
+            del self.revoked[jti]
+
+
+revocations = RevocationList()
+
+
+def issue_token(user_id: int, role: str, kind: str, ttl: int) -> str:
+    now = int(time.time())
+    claims = dict(
+        sub=str(user_id),
+        role=role,
+        type=kind,
+        iat=now,
+        exp=now + ttl,
+        jti=uuid.uuid4().hex,
+    )
+    return jwt.encode(claims, env.JWT_SECRET, algorithm=env.JWT_ALGORITHM)
+
+
+def issue_tokens(user_id: int, role: str) -> dict:
+    return dict(
+        access_token=issue_token(user_id, role, "access", env.ACCESS_TOKEN_TTL),
+        refresh_token=issue_token(user_id, role, "refresh", env.REFRESH_TOKEN_TTL),
+        token_type="bearer",
+        expires_in=env.ACCESS_TOKEN_TTL,
+    )
+
+
+def decode_token(token: str, kind: str) -> dict:
+    """
+    Verify signature, expiry, type and this worker's revocations; no
+    database involved. Refresh tokens must still be `consume`d.
+    """
+    try:
+        claims = jwt.decode(token, env.JWT_SECRET, algorithms=[env.JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(401, detail={
+            "message": "token expired",
+            "error": "invalid credentials",
+        })
+    except jwt.InvalidTokenError:
+        raise HTTPException(401, detail={
+            "message": "token is invalid",
+            "error": "invalid credentials",
+        })
+
+    if claims.get("type") != kind or revocations.is_revoked(claims.get("jti")):
+        raise HTTPException(401, detail={
+            "message": "token is invalid",
+            "error": "invalid credentials",
+        })
+
+    claims["id"] = int(claims["sub"])
+    return claims
+
+
+async def current_user(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(bearer)],
+) -> dict:
+    if credentials is None:
+        raise HTTPException(401, detail={
+            "message": "missing bearer token",
+            "error": "invalid credentials",
+        }, headers={"WWW-Authenticate": "Bearer"})
+
+    return decode_token(credentials.credentials, "access")
+
+
+CurrentUser = Annotated[dict, Depends(current_user)]
@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from config import env
+from lib.log import logger
+from lib.storage import Storage
+
+# storage clients are blocking, uploads get their own threads so they
+# can't starve the default executor used for rendering
+executor = ThreadPoolExecutor(max_workers=env.UPLOAD_WORKERS, thread_name_prefix="upload")
+
+
+async def upload_file(
+    storage: Storage, name: str, file: BytesIO, content_type: str = "image/png",
+    retries: int = None, backoff: float = None,
+) -> str:
+    """
+    Upload `file` as a public object `name` off the event loop and return
+    its public url. Failed attempts are retried with exponential backoff.
+    """
+    retries = env.UPLOAD_RETRIES if retries is None else retries
+    backoff = env.UPLOAD_BACKOFF if backoff is None else backoff
+    loop = asyncio.get_running_loop()
+
+    for attempt in range(retries + 1):
+        try:
+            return await loop.run_in_executor(executor, storage.put, name, file, content_type)
+        except Exception:
+            if attempt == retries:
+                raise
+            logger.warning("upload of %s failed, attempt %d of %d", name, attempt + 1, retries + 1, exc_info=True)
+            await asyncio.sleep(backoff * 2 ** attempt)
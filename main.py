@@ -1,19 +1,63 @@
 from contextlib import asynccontextmanager
 
 import uvicorn as uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
+from config import env
+from database import migrate
 from database.db import database
-from routes import auth, session, venue
+from lib.active_sessions import active_sessions
+from lib.ingest import punch_batcher
+from lib import metrics
+from lib.archive import session_archiver
+from lib.health import health
+from lib.last_login import last_login_writer
+from lib.log import logs
+from lib.passwords import shutdown_hash_pool
+from lib.qrcode import shutdown_render_pool
+from lib.session_closer import session_closer
+from lib.tag_index import tag_index
+from routes import analytics, auth, export, health as health_routes, occupancy, qrcode, report, session, venue
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    logs.start(env.LOG_LEVEL)
+
+    # migrate before the pool exists so its connections prepare against the final schema
+    conn = await migrate.connect()
+    try:
+        if env.DB_MIGRATE_ON_STARTUP:
+            await migrate.migrate(conn)
+        await migrate.ensure_partitions(conn, env.SESSION_PARTITIONS_AHEAD)
+    finally:
+        await conn.close()
+
     await database.connect()
+    await active_sessions.start()
+    await tag_index.load()
+    if env.PUNCH_INGEST_MODE == "batched":
+        await punch_batcher.start()
+    await last_login_writer.start()
+    if env.SESSION_AUTO_CLOSE:
+        await session_closer.start()
+    await session_archiver.load()
+    if env.SESSION_ARCHIVE:
+        await session_archiver.start()
+    health.started = True
     yield
 
+    health.drain()
+    await session_archiver.stop()
+    await session_closer.stop()
+    await last_login_writer.stop()
+    await punch_batcher.stop()
+    await active_sessions.stop()
+    shutdown_render_pool()
+    shutdown_hash_pool()
     await database.disconnect()
+    logs.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -21,6 +65,12 @@ app = FastAPI(lifespan=lifespan)
 app.include_router(router=auth.router)
 app.include_router(router=venue.router)
 app.include_router(router=session.router)
+app.include_router(router=report.router)
+app.include_router(router=analytics.router)
+app.include_router(router=export.router)
+app.include_router(router=qrcode.router)
+app.include_router(router=health_routes.router)
+app.include_router(router=occupancy.router)
 
 origins = [
     "http://localhost",
@@ -34,8 +84,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+
+
+@app.get("/database")
+async def database_stats():
+    return database.stats()
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    metrics.observe_pool(database.stats())
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 
 @app.get("/")
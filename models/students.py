@@ -32,6 +32,7 @@ class Session(Record):
     punch_out_time: datetime
     duration: str
     is_active: bool
+    change_version: int
 
 
 def create_session_from(record: Session):
@@ -0,0 +1,49 @@
+import traceback
+
+from fastapi import APIRouter, HTTPException
+
+from lib.analytics import analytics_cache, get_analytics
+from lib.log import logger
+from routes.report import Span
+from util import get_range
+
+router = APIRouter(prefix="/analytics", tags=["analytics",])
+
+
+async def analytics_report(venue_id: int | None, category: str | None, span: Span, date: int | None) -> dict:
+    start, end = get_range(span, date)
+
+    try:
+        result = await get_analytics(venue_id, category, start, end)
+        return dict(venue_id=venue_id, category=category, span=span, start=start, end=end, **result)
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("analytics_report failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.get("")
+async def get_all_analytics(span: Span = "week", date: int | None = None):
+    """Occupancy and dwell time across every venue, dwell also per category."""
+    return await analytics_report(None, None, span, date)
+
+
+@router.get("/cache/stats")
+async def get_analytics_cache_stats():
+    return analytics_cache.stats()
+
+
+@router.get("/category/{category}")
+async def get_category_analytics(category: str, span: Span = "week", date: int | None = None):
+    return await analytics_report(None, category, span, date)
+
+
+@router.get("/venue/{venue_id}")
+async def get_venue_analytics(venue_id: int, span: Span = "week", date: int | None = None):
+    return await analytics_report(venue_id, None, span, date)
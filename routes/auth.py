@@ -1,17 +1,20 @@
-import io
 import traceback
 from datetime import datetime
-from hashlib import sha256
 from typing import *
-from venv import logger
 
 from asyncpg import Connection
 from asyncpg.transaction import Transaction
-from fastapi import APIRouter, Form, HTTPException
+from fastapi import APIRouter, Form, HTTPException, Request
 
-from database.db import tables, database
+from config import env
+from database import queries
+from database.db import HIGH, LOW, database
+from lib.last_login import last_login_writer
+from lib.log import logger
+from lib.passwords import hash_password, hash_passwords
+from lib.tokens import CurrentUser, decode_token, issue_tokens, revocations
 from models.students import Users
-from util import log
+from util import BIGINT_MAX, INT_MAX, count_import, is_number, log, read_import
 
 router = APIRouter(prefix="/auth", tags=["auth", ])
 
@@ -21,48 +24,47 @@ async def login(
     password: Annotated[str, Form()],
 ):
 
-    pass_hash = sha256(io.BytesIO(password.encode('utf-8')).read()).hexdigest()
+    pass_hash = hash_password(password)
 
     try:
         conn: Connection
-        async with database.pool.acquire() as conn:
-            async with conn.transaction():
-                stmt = f"select * from users where id=$1 "
-                data = (int(id),)
-                user: Users = await conn.fetchrow(stmt, *data, record_class=Users)
-
-                if user is None:
-                    raise HTTPException(status_code=404, detail={
-                        "id": id,
-                        "message": "No User Found",
-                    })
-
-                if user["password"] != pass_hash:
-                    raise HTTPException(status_code=401, detail={
-                        "message": "password is incorrect",
-                        "error": "invalid credentials"
-                    })
-
-                stmt = "update users set last_login=$1 where id=$2"
-                date = datetime.now()
-                args = (date, id)
-                await conn.execute(stmt, *args)
+        async with database.read(user_id=id, priority=HIGH) as conn:
+            stmt = queries.USER_BY_ID
+            data = (int(id),)
+            user: Users = await conn.fetchrow(stmt, *data, record_class=Users)
 
-                return dict(
-                    id=id,
-                    status=200,
-                    message="authentication successful",
-                    user={
-                        "firstname": user["firstname"],
-                        "midname": user["midname"],
-                        "lastname": user["lastname"],
-                        "email": user["email"],
-                        "phone": user['phone'],
-                        "role": user["role"],
-                        "create_time": user['create_time'],
-                        "last_login": f"{date}"
-                    }
-                )
+        if user is None:
+            raise HTTPException(status_code=404, detail={
+                "id": id,
+                "message": "No User Found",
+            })
+
+        if user["password"] != pass_hash:
+            raise HTTPException(status_code=401, detail={
+                "message": "password is incorrect",
+                "error": "invalid credentials"
+            })
+
+        # written in batches by last_login_writer
+        date = datetime.now()
+        last_login_writer.record(id, date)
+
+        return dict(
+            id=id,
+            status=200,
+            message="authentication successful",
+            **issue_tokens(id, user["role"]),
+            user={
+                "firstname": user["firstname"],
+                "midname": user["midname"],
+                "lastname": user["lastname"],
+                "email": user["email"],
+                "phone": user['phone'],
+                "role": user["role"],
+                "create_time": user['create_time'],
+                "last_login": f"{date}"
+            }
+        )
 
     except HTTPException as error:
         raise error
@@ -75,6 +77,57 @@ async def login(
         })
 
 
+@router.post("/refresh")
+async def refresh(refresh_token: Annotated[str, Form()]):
+    claims = decode_token(refresh_token, "refresh")
+
+    # refresh tokens are single use, on every worker
+    if not await revocations.consume(claims["jti"], claims["exp"]):
+        raise HTTPException(401, detail={
+            "message": "token is invalid",
+            "error": "invalid credentials",
+        })
+
+    return dict(
+        id=claims["id"],
+        status=200,
+        message="token refreshed",
+        **issue_tokens(claims["id"], claims["role"]),
+    )
+
+
+@router.post("/logout")
+async def logout(
+    user: CurrentUser,
+    refresh_token: Annotated[str | None, Form()] = None,
+):
+    revocations.revoke(user["jti"], user["exp"])
+
+    if refresh_token is not None:
+        claims = decode_token(refresh_token, "refresh")
+        if claims["id"] != user["id"]:
+            raise HTTPException(403, detail={
+                "message": "refresh token belongs to another user",
+                "error": "invalid credentials",
+            })
+        await revocations.consume(claims["jti"], claims["exp"])
+
+    return dict(
+        id=user["id"],
+        status=200,
+        message="logged out",
+    )
+
+
+@router.get("/me")
+async def me(user: CurrentUser):
+    return dict(
+        id=user["id"],
+        role=user["role"],
+        expires=user["exp"],
+    )
+
+
 
 
 @router.post('/signup')
@@ -90,12 +143,11 @@ async def sign_up(
 ):
     try:
         conn: Connection
-        async with database.pool.acquire() as conn:
-            pass_hash = sha256(io.BytesIO(password.encode('utf-8')).read()).hexdigest()
+        async with database.write() as conn:
+            pass_hash = hash_password(password)
             transaction: Transaction
             async with conn.transaction():
-                users: Users = await conn.fetchrow(
-                    f"select * from {tables["users"]} where id=$1", id, record_class=Users)
+                users: Users = await conn.fetchrow(queries.USER_BY_ID, id, record_class=Users)
 
                 if users is not None:
                     raise HTTPException(status_code=409, detail={
@@ -108,13 +160,11 @@ async def sign_up(
                         }
                     )
                 date = datetime.now()
-                stmt:str = """
-                        insert into users (id, create_time, email, password, phone, role, firstname, midname, lastname)
-                        values($1, $2, $3, $4, $5, $6, $7, $8, $9);    
-                """
+                stmt: str = queries.USER_INSERT
                 value = (id, date, email, pass_hash, int(phone), role, firstname, midname, lastname)
 
                 await conn.execute(stmt, *value)
+                database.mark_write(id)
 
                 return dict(
                     id=id,
@@ -125,7 +175,6 @@ async def sign_up(
     except HTTPException as error:
         raise error
     except Exception as error:
-        logger.error(traceback.format_exc())
         log("/auth/signup", error)
         raise HTTPException(status_code=500, detail={
             "name": "Signup error.",
@@ -133,4 +182,115 @@ async def sign_up(
             "error": traceback.format_exc(),
             "status": 500,
             "message": "contact support"
-        })
\ No newline at end of file
+        })
+
+
+USER_COLUMNS = ["id", "create_time", "email", "password", "phone", "role", "firstname", "midname", "lastname"]
+
+
+def parse_users(rows: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Split raw import rows into valid users and per-row errors."""
+    users, report, seen = [], [], set()
+
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            report.append(dict(row=line, id=None, status="invalid", error="expected an object"))
+            continue
+
+        user_id = str(row.get("id", "")).strip()
+        password = str(row.get("password") or "")
+        phone = str(row.get("phone") or "").strip()
+
+        # users.id is an int and users.phone a bigint
+        if (not is_number(user_id, INT_MAX) or not password
+                or (phone and not is_number(phone, BIGINT_MAX))):
+            report.append(dict(row=line, id=user_id, status="invalid",
+                               error="id must be a number, password is required and phone must be digits"))
+            continue
+
+        if user_id in seen:
+            report.append(dict(row=line, id=int(user_id), status="duplicate",
+                               error="id repeated in this import"))
+            continue
+
+        seen.add(user_id)
+        users.append(dict(
+            row=line,
+            id=int(user_id),
+            password=password,
+            email=str(row.get("email") or "").strip() or None,
+            phone=int(phone) if phone else None,
+            role=str(row.get("role") or "").strip() or "student",
+            firstname=str(row.get("firstname") or "").strip() or None,
+            midname=str(row.get("midname") or "").strip() or None,
+            lastname=str(row.get("lastname") or "").strip() or None,
+        ))
+
+    return users, report
+
+
+@router.post("/signup/bulk")
+async def sign_up_bulk(request: Request):
+    """
+    Create many users from a CSV (id,password,email,phone,role,firstname,
+    midname,lastname) or a JSON list.
+
+    Passwords are hashed in a process pool, the rows are COPYed into a
+    temporary table and merged into users with one statement, so an import
+    is a few round trips whatever its size. Existing ids are left alone.
+    """
+    try:
+        rows = await read_import(request, "users")
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        raise HTTPException(400, detail={
+            "error": error.args,
+            "message": "expected a CSV file or a JSON list of users",
+        })
+
+    if len(rows) > env.BULK_USER_LIMIT:
+        raise HTTPException(413, detail={
+            "message": f"at most {env.BULK_USER_LIMIT} users per import",
+        })
+
+    users, report = parse_users(rows)
+
+    try:
+        hashes = await hash_passwords([user['password'] for user in users])
+
+        now = datetime.now()
+        records = [
+            (user['id'], now, user['email'], pass_hash, user['phone'], user['role'],
+             user['firstname'], user['midname'], user['lastname'])
+            for user, pass_hash in zip(users, hashes)
+        ]
+
+        conn: Connection
+        async with database.write(priority=LOW) as conn:
+            async with conn.transaction():
+                await conn.execute(queries.USERS_IMPORT_STAGE)
+                await conn.copy_records_to_table("users_import", records=records, columns=USER_COLUMNS)
+                created = {row['id'] for row in await conn.fetch(queries.USERS_IMPORT_MERGE)}
+
+        for user in users:
+            if user['id'] in created:
+                database.mark_write(user['id'])
+            report.append(dict(
+                row=user['row'], id=user['id'],
+                status="created" if user['id'] in created else "exists",
+            ))
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("sign_up_bulk failed")
+        raise HTTPException(500, detail={
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+    return dict(
+        total=len(rows),
+        counts=count_import(report),
+        users=report,
+    )
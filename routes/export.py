@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Literal
+
+from asyncpg import Connection
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from database.db import database
+from lib.archive import session_archiver
+from lib.log import logger
+from util import get_datetime
+
+router = APIRouter(prefix="/export", tags=["export",])
+
+CHUNK_SIZE = 2000
+
+COLUMNS = (
+    "id", "description", "user_id", "venue_id",
+    "punch_in_time", "punch_out_time", "duration", "is_active",
+)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def build_query(
+    user_id: int | None, venue_id: int | None, start: int | None, end: int | None
+) -> tuple[str, list]:
+    where, args = [], []
+    lower = get_datetime(start) if start is not None else None
+
+    if user_id is not None:
+        args.append(user_id)
+        where.append(f"user_id = ${len(args)}")
+    if venue_id is not None:
+        args.append(venue_id)
+        where.append(f"venue_id = ${len(args)}")
+    if lower is not None:
+        args.append(lower)
+        where.append(f"punch_in_time >= ${len(args)}")
+    if end is not None:
+        args.append(get_datetime(end))
+        where.append(f"punch_in_time < ${len(args)}")
+
+    stmt = f"""
+        select id, description, user_id, venue_id,
+               punch_in_time, punch_out_time, duration::text, is_active
+        from {session_archiver.source(lower)}
+        {"where " + " and ".join(where) if where else ""}
+        order by punch_in_time, id
+    """
+    return stmt, args
+
+
+async def stream_rows(conn: Connection, stmt: str, args: list) -> AsyncIterator[list]:
+    """Yield result rows in chunks through a server-side cursor."""
+    async with conn.transaction(readonly=True):
+        cursor = await conn.cursor(stmt, *args)
+        while True:
+            rows = await cursor.fetch(CHUNK_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+async def as_ndjson(chunks: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield "".join(
+            json.dumps(dict(row), default=str) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+async def as_csv(chunks: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+
+    async for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+@router.get("/sessions")
+async def export_sessions(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: int | None = None,
+    venue_id: int | None = None,
+    start: int | None = None,
+    end: int | None = None,
+):
+    stmt, args = build_query(user_id, venue_id, start, end)
+
+    # take the connection before any byte is sent, so an overloaded pool
+    # still answers with a clean 503 instead of a cut-off stream
+    resources = AsyncExitStack()
+    conn: Connection = await resources.enter_async_context(database.read())
+    chunks = stream_rows(conn, stmt, args)
+
+    async def body():
+        try:
+            encode = as_csv if format == "csv" else as_ndjson
+            async for data in encode(chunks):
+                yield data
+        except Exception:
+            # headers are already sent, all we can do is cut the stream short
+            logger.exception("export_sessions failed")
+            raise
+        finally:
+            await resources.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="sessions.{format}"',
+        },
+        # also runs when the client goes away before the body is finished
+        background=BackgroundTask(resources.aclose),
+    )
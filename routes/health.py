@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Response
+
+from lib.health import health
+
+router = APIRouter(prefix="/health", tags=["health",])
+
+
+@router.get("/live")
+async def liveness():
+    return health.live()
+
+
+@router.get("/ready")
+async def readiness(response: Response):
+    ok, detail = await health.ready()
+    if not ok:
+        response.status_code = 503
+    return detail
@@ -0,0 +1,91 @@
+import json
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from config import env
+from lib.occupancy import occupancy
+
+router = APIRouter(prefix="/occupancy", tags=["occupancy",])
+
+
+def encode(event: dict) -> str:
+    return json.dumps(event, default=str)
+
+
+async def event_stream(venue_id: int | None):
+    subscription = occupancy.subscribe(venue_id)
+    try:
+        # browsers reconnect after `retry` ms and get a fresh snapshot,
+        # also when the stream ends because the worker is draining
+        yield f"retry: {env.OCCUPANCY_RETRY_MS}\n\n"
+
+        # StreamingResponse cancels this generator when the client goes away
+        async for event in occupancy.events(subscription, env.OCCUPANCY_HEARTBEAT):
+            if event is None:
+                yield ": ping\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {encode(event)}\n\n"
+    finally:
+        occupancy.unsubscribe(subscription)
+
+
+async def socket_stream(websocket: WebSocket, venue_id: int | None):
+    await websocket.accept()
+    subscription = occupancy.subscribe(venue_id)
+    try:
+        async for event in occupancy.events(subscription, env.OCCUPANCY_HEARTBEAT):
+            if event is None:
+                event = dict(type="ping")
+            await websocket.send_text(encode(event))
+        # the worker is draining, 1012 asks the client to reconnect elsewhere
+        await websocket.close(code=1012)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        occupancy.unsubscribe(subscription)
+
+
+def sse(venue_id: int | None) -> StreamingResponse:
+    return StreamingResponse(
+        event_stream(venue_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("")
+async def get_occupancy():
+    return occupancy.snapshot(None)
+
+
+@router.get("/stats")
+async def get_occupancy_stats():
+    return occupancy.stats()
+
+
+@router.get("/events")
+async def occupancy_events():
+    """Server-sent events: counts of every venue, then every punch."""
+    return sse(None)
+
+
+@router.websocket("/ws")
+async def occupancy_socket(websocket: WebSocket):
+    await socket_stream(websocket, None)
+
+
+@router.get("/{venue_id}")
+async def get_venue_occupancy(venue_id: int):
+    return occupancy.snapshot(venue_id)
+
+
+@router.get("/{venue_id}/events")
+async def venue_occupancy_events(venue_id: int):
+    """Server-sent events: who is in the venue now, then its punches."""
+    return sse(venue_id)
+
+
+@router.websocket("/{venue_id}/ws")
+async def venue_occupancy_socket(websocket: WebSocket, venue_id: int):
+    await socket_stream(websocket, venue_id)
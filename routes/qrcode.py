@@ -0,0 +1,62 @@
+import traceback
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+from lib.log import logger
+from lib.qr_store import qr_store
+
+router = APIRouter(prefix="/qrcode", tags=["qrcode",])
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+# artifacts are content addressed, a url never points at different bytes
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/stats")
+async def get_qr_store_stats():
+    return qr_store.stats()
+
+
+@router.get("/{qr_id}.{kind}")
+async def get_qr_image(
+    qr_id: str,
+    kind: Literal["png", "svg"],
+    request: Request,
+    scale: int = Query(default=10, ge=1, le=40),
+):
+    etag = f'"{qr_id}-{scale}-{kind}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+    try:
+        # a matching etag only counts for an artifact that exists; the
+        # tag lookup is cached, including misses
+        if await qr_store.tag_of(qr_id) is None:
+            data = None
+        elif request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        else:
+            data = await qr_store.get(qr_id, kind, scale)
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("get_qr_image failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+    if data is None:
+        raise HTTPException(404, detail={
+            "qr_id": qr_id,
+            "error": "Resource Not Found",
+            "status": 404,
+        })
+
+    return Response(content=data, media_type=MEDIA_TYPES[kind], headers=headers)
@@ -0,0 +1,147 @@
+import traceback
+from typing import Literal
+
+from asyncpg import Connection, LockNotAvailableError
+from fastapi import APIRouter, HTTPException
+
+from config import env
+from database import queries
+from database.db import database
+from lib.log import logger
+from lib.rollup import rollup
+from util import get_range
+
+router = APIRouter(prefix="/report", tags=["report",])
+
+Span = Literal["day", "week", "semester"]
+
+
+def summarize(rows, key: str) -> list[dict]:
+    return [
+        {
+            key: row[key],
+            "sessions": row["sessions"],
+            "seconds": row["seconds"],
+            "hours": round(row["seconds"] / 3600, 2),
+        }
+        for row in rows
+    ]
+
+
+@router.get("/user/{uid}")
+async def get_user_report(uid: int, span: Span = "week", date: int | None = None):
+    start, end = get_range(span, date)
+
+    try:
+        conn: Connection
+        async with database.read() as conn:
+            by_day = await conn.fetch(queries.REPORT_USER_BY_DAY, uid, start, end)
+            by_category = await conn.fetch(queries.REPORT_USER_BY_CATEGORY, uid, start, end)
+
+            return dict(
+                user_id=uid,
+                span=span,
+                start=start,
+                end=end,
+                sessions=sum(row["sessions"] for row in by_day),
+                seconds=sum(row["seconds"] for row in by_day),
+                days=summarize(by_day, "day"),
+                categories=summarize(by_category, "category"),
+            )
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("get_user_report failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.get("/venue/{venue_id}")
+async def get_venue_report(venue_id: int, span: Span = "week", date: int | None = None):
+    start, end = get_range(span, date)
+
+    try:
+        conn: Connection
+        async with database.read() as conn:
+            rows = await conn.fetch(queries.REPORT_VENUE_BY_DAY, venue_id, start, end)
+
+            return dict(
+                venue_id=venue_id,
+                span=span,
+                start=start,
+                end=end,
+                sessions=sum(row["sessions"] for row in rows),
+                seconds=sum(row["seconds"] for row in rows),
+                days=[
+                    dict(summarize([row], "day")[0], visitors=row["visitors"])
+                    for row in rows
+                ],
+            )
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("get_venue_report failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.get("/category/{category}")
+async def get_category_report(category: str, span: Span = "week", date: int | None = None):
+    start, end = get_range(span, date)
+
+    try:
+        conn: Connection
+        async with database.read() as conn:
+            by_day = await conn.fetch(queries.REPORT_CATEGORY_BY_DAY, category, start, end)
+            by_venue = await conn.fetch(queries.REPORT_CATEGORY_BY_VENUE, category, start, end)
+
+            return dict(
+                category=category,
+                span=span,
+                start=start,
+                end=end,
+                sessions=sum(row["sessions"] for row in by_day),
+                seconds=sum(row["seconds"] for row in by_day),
+                days=summarize(by_day, "day"),
+                venues=summarize(by_venue, "venue_id"),
+            )
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("get_category_report failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.post("/rebuild")
+async def rebuild_report():
+    try:
+        rows = await rollup.rebuild()
+        return dict(message="engagement rollup rebuilt", **rows)
+
+    except HTTPException as error:
+        raise error
+    except LockNotAvailableError:
+        raise HTTPException(503, detail={
+            "message": "engagement tables are busy, retry later",
+            "status": 503,
+        }, headers={"Retry-After": str(env.DB_RETRY_AFTER)})
+    except Exception as error:
+        logger.exception("rebuild_report failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
@@ -1,17 +1,32 @@
 import traceback
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from typing import Annotated
 
 from asyncpg import Connection
-from fastapi import APIRouter, HTTPException, Form
-from pyparsing import Empty
-
-from database.db import database
+from fastapi import APIRouter, HTTPException, Form, Query, Request, Response
+from fastapi.responses import JSONResponse
+
+from config import env
+from database import queries
+from database.db import HIGH, database
+from lib.active_sessions import active_sessions
+from lib.archive import session_archiver
+from lib.ingest import punch_batcher
+from lib.log import logger
+from lib.rollup import rollup
+from lib.session_closer import session_closer
+from lib.tag_index import tag_index
 from models.students import Session, create_session_from
-from util import get_date
+from util import (decode_cursor, decode_sync_cursor, encode_cursor, encode_sync_cursor, get_date,
+                  get_datetime)
 
 router = APIRouter(prefix="/session", tags=["session",])
 
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+CLOSED_CACHE_CONTROL = "private, max-age=86400, immutable"
+
 def sanitize_session(session: Session) -> dict:
     data = dict(session)
     session = create_session_from(session)
@@ -26,119 +41,256 @@ def sanitize_session(session: Session) -> dict:
 
 
 @router.get("/user/{uid}")
-async def get_user_sessions(uid: int, date: int | None = None):
+async def get_user_sessions(
+    uid: int,
+    date: int | None = None,
+    start: int | None = None,
+    end: int | None = None,
+    venue_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Newest-first page of a user's sessions.
+
+    `date` selects one day, `start`/`end` an arbitrary punch-in range (ms
+    timestamps). Pages are keyed on (punch_in_time, id) so every page is
+    a range scan on the (user_id, punch_in_time, id) index; pass the
+    returned `next_cursor` back to get the following page. Ranges that
+    may reach past the retention window also read the archive.
+    """
+    if date is not None:
+        day = get_date(date)
+        lower, upper = datetime.combine(day, time.min), datetime.combine(day + timedelta(days=1), time.min)
+    else:
+        lower = get_datetime(start) if start is not None else None
+        upper = get_datetime(end) if end is not None else None
+
     try:
-        conn: Connection
-        async with database.pool.acquire() as conn:
-            async with conn.transaction():
-                stmt = """
-                    select *
-                    from session 
-                    where user_id = $1 and punch_in_time::date = $2
-                """
-                args = (uid, get_date(date))
-                sessions: list[Session] = await conn.fetch(stmt, *args, record_class=Session)
-
-                if sessions is Empty:
-                    raise HTTPException(404, detail={
-                        "message": "Resource Not Found",
-                        "status": 404,
-                    })
+        after = decode_cursor(cursor) if cursor is not None else None
+    except ValueError:
+        raise HTTPException(400, detail={
+            "cursor": cursor,
+            "message": "invalid cursor",
+        })
 
-                response = []
-                for session in sessions:
-                    response.append(sanitize_session(session))
+    where, args = ["user_id = $1"], [uid]
+    if venue_id is not None:
+        args.append(venue_id)
+        where.append(f"venue_id = ${len(args)}")
+    if lower is not None:
+        args.append(lower)
+        where.append(f"punch_in_time >= ${len(args)}")
+    if upper is not None:
+        args.append(upper)
+        where.append(f"punch_in_time < ${len(args)}")
+    if after is not None:
+        args.extend(after)
+        where.append(f"(punch_in_time, id) < (${len(args) - 1}, ${len(args)})")
+
+    args.append(limit + 1)
+    stmt = f"""
+        select *
+        from {session_archiver.source(lower)}
+        where {" and ".join(where)}
+        order by punch_in_time desc, id desc
+        limit ${len(args)}
+    """
+
+    try:
+        conn: Connection
+        async with database.read(user_id=uid) as conn:
+            sessions: list[Session] = await conn.fetch(stmt, *args, record_class=Session)
 
-                del sessions
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            last = sessions[-1]
+            next_cursor = encode_cursor(last['punch_in_time'], last['id'])
 
-                return dict(
-                    sessions=response
-                )
+        return dict(
+            sessions=[sanitize_session(session) for session in sessions],
+            next_cursor=next_cursor,
+        )
 
-    except Exception as error:
+    except HTTPException as error:
         raise error
+    except Exception as error:
+        logger.exception("get_user_sessions failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
 
 
-@router.get("/user/{uid}")
-async def get_user_sessions(uid: int):
+@router.get("/active/user/{uid}")
+async def get_user_active_sessions(uid: int):
+    if active_sessions.ready:
+        return dict(sessions=active_sessions.of_user(uid))
+
     try:
         conn: Connection
-        async with database.pool.acquire() as conn:
-            async with conn.transaction():
-                stmt = """
-                    select *
-                    from session 
-                    where user_id = $1  
-                """
+        async with database.read(user_id=uid, priority=HIGH) as conn:
+            stmt = queries.SESSIONS_ACTIVE_BY_USER
+            sessions = await conn.fetch(stmt, uid)
 
-                sessions: list[Session] = await conn.fetch(stmt, uid, record_class=Session)
+            return dict(sessions=[dict(session) for session in sessions])
 
-                if sessions is Empty:
-                    raise HTTPException(404, detail={
-                        "message": "Resource Not Found",
-                        "status": 404,
-                    })
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("get_user_active_sessions failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
 
-                response = []
-                for session in sessions:
-                    response.append(sanitize_session(session))
 
-                del sessions
+@router.get("/active/venue/{venue_id}")
+async def get_venue_active_sessions(venue_id: int):
+    if active_sessions.ready:
+        sessions = active_sessions.in_venue(venue_id)
+        return dict(venue_id=venue_id, count=len(sessions), sessions=sessions)
 
-                return dict(
-                    sessions=response
-                )
+    try:
+        conn: Connection
+        async with database.read(priority=HIGH) as conn:
+            stmt = queries.SESSIONS_ACTIVE_BY_VENUE
+            sessions = [dict(session) for session in await conn.fetch(stmt, venue_id)]
 
-    except Exception as error:
+            return dict(venue_id=venue_id, count=len(sessions), sessions=sessions)
+
+    except HTTPException as error:
         raise error
+    except Exception as error:
+        logger.exception("get_venue_active_sessions failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
 
 
-@router.get("/{id}")
-async def get_session(id: int):
+@router.get("/sync/{uid}")
+async def sync_sessions(
+    uid: int,
+    cursor: str | None = None,
+    limit: int = Query(default=MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Sessions of `uid` created or closed since `cursor`; no cursor returns
+    the whole history.
+
+    Follow `next_cursor` while `has_more` is true and keep the last one
+    for the next sync. A round resumes from the oldest transaction that
+    was still running when the previous round started, so a session may
+    come back twice; apply them as upserts by id.
+    """
+    try:
+        horizon, after = decode_sync_cursor(cursor) if cursor is not None else (0, None)
+    except ValueError:
+        raise HTTPException(400, detail={
+            "cursor": cursor,
+            "message": "invalid cursor",
+        })
+
     try:
         conn: Connection
-        async with database.pool.acquire() as conn:
-            stmt = """
-                select 
-                    s.id, s.description, s.user_id, s.venue_id, s.punch_in_time, s.punch_out_time, s.is_active, 
-                    v.category as venue_category
-                from session as s 
-                inner join
-                    venue as v
-                on 
-                    s.venue_id = v.id
-                where
-                    s.id = $1  
-            """
-            session: Session = await conn.fetchrow(stmt, id, record_class=Session)
+        # the horizon only holds on the host it was taken on: a replica
+        # that hasn't replayed an older transaction yet would skip its rows
+        async with database.read(user_id=uid, consistent=True) as conn:
+            if after is None:
+                # a new round; its own horizon is taken before reading any row
+                after = (horizon, 0)
+                horizon = await conn.fetchval(queries.SNAPSHOT_HORIZON)
+
+            stmt = queries.SESSIONS_CHANGED
+            sessions: list[Session] = await conn.fetch(stmt, uid, *after, limit + 1, record_class=Session)
+
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
+
+        if has_more:
+            last = sessions[-1]
+            next_cursor = encode_sync_cursor(horizon, (last['change_version'], last['id']))
+        else:
+            next_cursor = encode_sync_cursor(horizon)
+
+        return dict(
+            sessions=[sanitize_session(session) for session in sessions],
+            next_cursor=next_cursor,
+            has_more=has_more,
+        )
 
-            if session is None:
-                raise HTTPException(404, detail={
-                    "session_id": id,
-                    "error": "Resource Not Found",
-                    "status": 404,
-                })
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("sync_sessions failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
 
-            punch_in: datetime = session["punch_in_time"]
-            punch_out: datetime = session["punch_out_time"]
 
-            response = {
-                "id": session["id"],
-                "description": session['description'],
-                "user_id": session["user_id"],
-                "punch_in": punch_in.strftime("%A %d %b %y, %I:%M"),
-                "punch_out": punch_out.strftime("%A %d %b %y, %I:%M"),
-                "is_active": session['is_active'],
-                "venue_id": session['venue_id'],
-                "venue_category": session['venue_category']
-            }
+@router.get("/archive/stats")
+async def get_archive_stats():
+    return session_archiver.stats()
 
-            return response
+
+def session_etag(id: int, change_version: int, closed: bool) -> str:
+    return f'"s{id}-{change_version}{"-closed" if closed else ""}"'
+
+
+@router.get("/{id}")
+async def get_session(id: int, request: Request):
+    if_none_match = request.headers.get("if-none-match", "")
+
+    try:
+        conn: Connection
+        async with database.read() as conn:
+            stmt = queries.SESSION_DETAIL
+            session: Session = await conn.fetchrow(stmt, id, record_class=Session)
+
+        if session is None:
+            raise HTTPException(404, detail={
+                "session_id": id,
+                "error": "Resource Not Found",
+                "status": 404,
+            })
+
+        closed = not session['is_active']
+        etag = session_etag(id, session['change_version'], closed)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": CLOSED_CACHE_CONTROL if closed else "private, no-cache",
+        }
+
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+
+        punch_in: datetime = session["punch_in_time"]
+        punch_out: datetime | None = session["punch_out_time"]
+
+        response = {
+            "id": session["id"],
+            "description": session['description'],
+            "user_id": session["user_id"],
+            "punch_in": punch_in.strftime("%A %d %b %y, %I:%M"),
+            "punch_out": punch_out.strftime("%A %d %b %y, %I:%M") if punch_out else None,
+            "is_active": session['is_active'],
+            "venue_id": session['venue_id'],
+            "venue_category": session['venue_category']
+        }
+
+        return JSONResponse(response, headers=headers)
 
     except HTTPException as error:
         raise error
     except Exception as error:
-        print(traceback.format_exc())
+        logger.exception("get_session failed")
         raise HTTPException(500, detail={
             "name": f"{type(error).__class__.__name__}",
             "error": error.args,
@@ -153,30 +305,50 @@ async def register_session(
     desc: Annotated[str, Form()] = ""
 ):
     try:
+        if active_sessions.ready:
+            session: dict = active_sessions.get(uid, venue_id)
+
+            if session is not None:
+                return HTTPException(309, detail={
+                    "message": "session already registered",
+                    "session": {
+                        "id": session['id'],
+                        "user_id": uid,
+                        "venue_id": venue_id,
+                        "punch_in_time": session['punch_in_time'],
+                    }
+                })
+
+        if env.PUNCH_INGEST_MODE == "batched":
+            session: dict = await punch_batcher.punch_in(uid, venue_id, desc)
+
+            if not session.pop("created"):
+                return HTTPException(309, detail={
+                    "message": "session already registered",
+                    "session": session,
+                })
+
+            return session
+
         conn: Connection
-        async with database.pool.acquire() as conn:
+        async with database.write() as conn:
             async with conn.transaction():
-                stmt = """
-                    select * from session
-                    where user_id = $1 and venue_id = $2 and is_active = true;
-                """
-                session: Session = await conn.fetchrow(stmt, uid, venue_id, record_class=Session)
-
-                if session is not None:
-                    return HTTPException(309, detail={
-                        "message": "session already registered",
-                        "session": {
-                            "id": session['id'],
-                            "user_id": uid,
-                            "venue_id": venue_id,
-                            "punch_in_time": session['punch_in_time'],
-                        }
-                    })
-
-                stmt = """
-                    insert into session (description, user_id, venue_id, punch_in_time)
-                    values($1, $2, $3, $4) returning id; 
-                """
+                if not active_sessions.ready:
+                    stmt = queries.SESSION_ACTIVE_FOR_PAIR
+                    session: Session = await conn.fetchrow(stmt, uid, venue_id, record_class=Session)
+
+                    if session is not None:
+                        return HTTPException(309, detail={
+                            "message": "session already registered",
+                            "session": {
+                                "id": session['id'],
+                                "user_id": uid,
+                                "venue_id": venue_id,
+                                "punch_in_time": session['punch_in_time'],
+                            }
+                        })
+
+                stmt = queries.SESSION_INSERT
                 date = datetime.now()
                 values = (desc, uid, venue_id, date)
                 session: Session = await conn.fetchrow(stmt, *values, record_class=Session)
@@ -188,13 +360,103 @@ async def register_session(
                     "punch_in_time": date,
                     "is_active": True
                 }
+                await active_sessions.notify(conn, "in", [response])
 
-                return response
+            active_sessions.apply("in", [dict(response)])
+            database.mark_write(uid)
+            return response
 
     except HTTPException as error:
         raise error
     except Exception as error:
-        print(traceback.format_exc())
+        logger.exception("register_session failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.post("/scan")
+async def scan(
+    uid: Annotated[int, Form()],
+    tag: Annotated[str, Form()],
+    desc: Annotated[str, Form()] = ""
+):
+    """
+    One call per QR scan: resolve the raw tag to its venue, then punch
+    out if `uid` has an active session there, otherwise punch in.
+    """
+    try:
+        venue: dict = await tag_index.resolve(tag.strip())
+
+        if venue is None:
+            raise HTTPException(404, detail={
+                "tag": tag,
+                "message": "unknown qr code",
+            })
+
+        if active_sessions.ready:
+            session: dict = active_sessions.get(uid, venue['id'])
+        else:
+            conn: Connection
+            async with database.read(user_id=uid, consistent=True, priority=HIGH) as conn:
+                stmt = queries.SESSION_ACTIVE_FOR_PAIR
+                session: Session = await conn.fetchrow(stmt, uid, venue['id'], record_class=Session)
+
+        if session is not None:
+            response = await close_session(session['id'])
+            action = "out"
+        else:
+            response = await register_session(uid, venue['id'], desc)
+            action = "in"
+
+        if isinstance(response, HTTPException):
+            # punched in by a concurrent scan
+            return response
+
+        return dict(
+            response,
+            action=action,
+            venue=dict(id=venue['id'], category=venue['category']),
+        )
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("scan failed")
+        raise HTTPException(500, detail={
+            "name": f"{type(error).__class__.__name__}",
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+
+@router.put("/bulk")
+async def close_sessions(
+    venue_id: Annotated[int | None, Form()] = None,
+    before: Annotated[int | None, Form()] = None,
+):
+    """
+    Close every active session punched in before `before` (ms timestamp,
+    default now), of `venue_id` or of every venue, e.g. at the end of a
+    lecture or of the day. Runs as chunked set-based updates.
+    """
+    try:
+        cutoff = get_datetime(before) if before is not None else datetime.now()
+        closed = await session_closer.close(venue_id=venue_id, before=cutoff)
+
+        return dict(
+            venue_id=venue_id,
+            before=cutoff,
+            closed=closed,
+            message="sessions closed",
+        )
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("close_sessions failed")
         raise HTTPException(500, detail={
             "name": f"{type(error).__class__.__name__}",
             "error": error.args,
@@ -205,43 +467,62 @@ async def register_session(
 @router.put("")
 async def close_session(id: Annotated[int, Form()]):
     try:
+        if active_sessions.ready and active_sessions.get_by_id(id) is None:
+            raise HTTPException(404, detail={
+                "session": id,
+                "message": "session is already closed",
+            })
+
+        if env.PUNCH_INGEST_MODE == "batched":
+            # known while the index is live, so the owner can read their own write
+            owner: dict | None = active_sessions.get_by_id(id)
+            session: dict = await punch_batcher.punch_out(id)
+
+            if session is None:
+                raise HTTPException(404, detail={
+                    "session": id,
+                    "message": "session is already closed",
+                })
+
+            if owner is not None:
+                database.mark_write(owner['user_id'])
+            return dict(
+                id=id,
+                puch_out_time=session['punch_out_time'],
+                duration=session['duration'],
+                message="session closed"
+            )
+
         conn: Connection
-        async with database.pool.acquire() as conn:
+        async with database.write() as conn:
             async with conn.transaction():
-                stmt = """
-                    select * from session 
-                    where id = $1 and is_active = true
-                """
-
-                session: Session = await conn.fetchrow(stmt, id, record_class=Session)
+                date = datetime.now()
+                stmt = queries.SESSION_CLOSE
+                session: Session = await conn.fetchrow(stmt, date, id, record_class=Session)
 
+                # unknown id, or closed since the index was checked
                 if session is None:
                     raise HTTPException(404, detail={
                         "session": id,
                         "message": "session is already closed",
                     })
 
-                date = datetime.now()
-                stmt = """
-                    update session
-                    set 
-                        punch_out_time = $1, duration = age($1, punch_in_time), is_active = false
-                    returning duration::text;
-                """
-                session: Session = await conn.fetchrow(stmt, date, record_class=Session)
-
                 response: dict = dict(
                     id=id,
                     puch_out_time=date,
                     duration=session['duration'],
                     message="session closed"
                 )
+                await rollup.record(conn, [id])
+                await active_sessions.notify(conn, "out", [dict(id=id)])
 
-                return response
+            active_sessions.apply("out", [dict(id=id)])
+            database.mark_write(session['user_id'])
+            return response
 
     except HTTPException as error: raise error
     except Exception as error:
-        print(traceback.format_exc())
+        logger.exception("close_session failed")
         raise HTTPException(500, detail={
             "name": f"{type(error).__class__.__name__}",
             "error": error.args,
@@ -1,15 +1,25 @@
+import asyncio
+import json
 import traceback
 from hashlib import sha1
-from io import BytesIO
 from typing import Annotated
 
-from asyncpg import Connection
-from fastapi import APIRouter, Form, HTTPException
+from asyncpg import Connection, UniqueViolationError
+from fastapi import APIRouter, Form, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 
-from database.db import database
-from firebase.firebase import firebase_bucket
-from lib.qrcode import generate_qr_code
+from config import env
+from database import queries
+from database.db import LOW, database
+from lib.cache import venue_cache
+from lib.log import logger
+from lib.qr_store import qr_store
+from lib.qrcode import make_tag, qr_id_of, render_qr_code, render_qr_codes
+from lib.storage import get_storage
+from lib.tag_index import tag_index
+from lib.upload import upload_file
 from models.students import Venue
+from util import INT_MAX, count_import, is_number, read_import
 
 router = APIRouter(prefix="/venue", tags=["venue",])
 
@@ -21,49 +31,59 @@ async def add_new_venue(
     conn: Connection
 
     try:
-        async with database.pool.acquire() as conn:
-            async with conn.transaction():
-                venue: Venue = await conn.fetchrow(
-                    "select * from venue where id=$1;",
-                    int(venue_id), record_class=Venue)
-
-                if venue is not None:
-                    raise HTTPException(409, detail={
-                        "venue_id": venue["id"],
-                        "message": "venue already exist",
-                        "venue": {
-                            "id": venue["id"],
-                            "category": venue["category"],
-                        }
-                    })
-
-                img, tag = generate_qr_code(venue_id, category)
-                qr_id = sha1(BytesIO(tag.encode('utf-8')).read()).hexdigest()
+        async with database.read(consistent=True) as conn:
+            venue: Venue = await conn.fetchrow(queries.VENUE_BY_ID, int(venue_id), record_class=Venue)
 
-                try:
-                    blob = firebase_bucket.blob(tag)
-                    blob.upload_from_file(img, content_type="image/png", rewind=True)
-                    blob.make_public()
-                    qr_image_url = blob.public_url
+        if venue is not None:
+            raise HTTPException(409, detail={
+                "venue_id": venue["id"],
+                "message": "venue already exist",
+                "venue": {
+                    "id": venue["id"],
+                    "category": venue["category"],
+                }
+            })
 
-                except Exception as error:
-                    print(traceback.format_exc())
-                    raise HTTPException(500, detail={
-                        "name": error.args,
-                        "error": "file upload error",
-                    })
+        tag = make_tag(venue_id, category)
+        qr_id = qr_id_of(tag)
+
+        # an artifact with this content hash is already uploaded, reuse it
+        qr_image_url = (await qr_store.existing_urls([qr_id])).get(qr_id)
 
-                await conn.execute("insert into qr_code values($1, $2);", qr_id, qr_image_url)
+        # render and upload without holding a pool connection or transaction
+        if qr_image_url is None:
+            img, tag = await render_qr_code(venue_id, category)
+            await qr_store.put(qr_id, tag, img.getvalue())
+
+            try:
+                qr_image_url = await upload_file(get_storage(), f"{qr_id}.png", img, content_type="image/png")
+
+            except Exception as error:
+                logger.exception("qr code upload failed")
+                raise HTTPException(500, detail={
+                    "name": error.args,
+                    "error": "file upload error",
+                })
+
+        async with database.write(priority=LOW) as conn:
+            async with conn.transaction():
+                await conn.execute(queries.QR_CODE_UPSERT, qr_id, qr_image_url, tag)
 
                 values = (int(venue_id), qr_id, category)
-                venue = await conn.fetchrow(
-                    "insert into venue(id, qr_id, category) values($1, $2, $3) returning *;",
-                    *values, record_class=Venue
-                )
+                venue = await conn.fetchrow(queries.VENUE_INSERT, *values, record_class=Venue)
+
+        venue_cache.invalidate(venue['id'])
+        tag_index.add(tag, venue['id'], venue['category'], qr_id)
 
     except HTTPException as error: raise error
+    except UniqueViolationError:
+        # lost a race with a concurrent request for the same venue
+        raise HTTPException(409, detail={
+            "venue_id": int(venue_id),
+            "message": "venue already exist",
+        })
     except Exception as error:
-        print(traceback.format_exc())
+        logger.exception("add_new_venue failed")
         raise HTTPException(status_code=500, detail={
             "error": error.args,
             "trace": traceback.format_exc()
@@ -79,47 +99,200 @@ async def add_new_venue(
     }
 
 
-@router.get("/{id}")
-async def get_session(id: int):
+def parse_venues(rows: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Split raw import rows into valid venues and per-row errors."""
+    venues, report, seen = [], [], set()
+
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            report.append(dict(row=line, venue_id=None, status="invalid", error="expected an object"))
+            continue
+
+        venue_id = str(row.get("venue_id", row.get("id", ""))).strip()
+        category = str(row.get("category", "")).strip()
+
+        if not is_number(venue_id, INT_MAX) or not category:
+            report.append(dict(row=line, venue_id=venue_id, status="invalid",
+                               error="venue_id must be a number and category is required"))
+            continue
+
+        if venue_id in seen:
+            report.append(dict(row=line, venue_id=int(venue_id), status="duplicate",
+                               error="venue_id repeated in this import"))
+            continue
+
+        seen.add(venue_id)
+        venues.append(dict(row=line, venue_id=int(venue_id), category=category))
+
+    return venues, report
+
+
+@router.post("/bulk")
+async def add_venues_bulk(request: Request):
+    """
+    Create many venues from a CSV (venue_id,category) or a JSON list.
+
+    QR codes are rendered in a process pool and uploaded with at most
+    BULK_UPLOAD_CONCURRENCY uploads in flight; all qr_code and venue rows
+    go in with one statement. Every input row gets a status in the report.
+    """
+    try:
+        rows = await read_import(request, "venues")
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        raise HTTPException(400, detail={
+            "error": error.args,
+            "message": "expected a CSV file or a JSON list of venues",
+        })
+
+    if len(rows) > env.BULK_VENUE_LIMIT:
+        raise HTTPException(413, detail={
+            "message": f"at most {env.BULK_VENUE_LIMIT} venues per import",
+        })
+
+    venues, report = parse_venues(rows)
+
     try:
         conn: Connection
-        async with database.pool.acquire() as conn:
-            async with conn.transaction():
-                stmt = """
-                    select 
-                       v.category, v.id, qr.id as qr_id, qr.url
-                    from 
-                        venue v
-                    inner join
-                        qr_code as qr 
-                    on v.qr_id = qr.id
-                    where v.id = $1
-                """
-                venue: Venue = await conn.fetchrow(stmt, id, record_class=Venue)
-
-                if venue is None:
-                    raise HTTPException(404, detail={
-                        "session_id": id,
-                        "error": "Resource Not Found",
-                        "status": 404,
-                    })
-
-                response: dict = {
-                    "id": id,
-                    "category": venue['category'],
-                    "qr_code": {
-                        "id": venue['qr_id'],
-                        "url": venue['url']
-                    }
+        async with database.read(consistent=True) as conn:
+            existing = {
+                row['id'] for row in await conn.fetch(
+                    queries.VENUE_IDS_EXISTING, [v['venue_id'] for v in venues])
+            }
+
+        pending = []
+        for venue in venues:
+            if venue['venue_id'] in existing:
+                report.append(dict(venue, status="exists"))
+            else:
+                pending.append(venue)
+
+        for venue in pending:
+            venue['tag'] = make_tag(str(venue['venue_id']), venue['category'])
+            venue['qr_id'] = qr_id_of(venue['tag'])
+
+        # only render and upload artifacts that are not stored yet
+        stored = await qr_store.existing_urls([v['qr_id'] for v in pending])
+        for venue in pending:
+            if venue['qr_id'] in stored:
+                venue['qr_code_url'] = stored[venue['qr_id']]
+
+        missing = [v for v in pending if 'qr_code_url' not in v]
+        rendered = await render_qr_codes([(str(v['venue_id']), v['category']) for v in missing])
+
+        limit = asyncio.Semaphore(env.BULK_UPLOAD_CONCURRENCY)
+
+        async def upload(venue: dict, result):
+            if isinstance(result, Exception):
+                venue.update(status="failed", error=f"render error: {result}")
+                return
+
+            img, tag = result
+            await qr_store.put(venue['qr_id'], tag, img.getvalue())
+            async with limit:
+                try:
+                    venue['qr_code_url'] = await upload_file(
+                        get_storage(), f"{venue['qr_id']}.png", img, content_type="image/png")
+                except Exception as error:
+                    venue.update(status="failed", error=f"upload error: {error}")
+
+        await asyncio.gather(*(upload(v, r) for v, r in zip(missing, rendered)))
+
+        uploaded = [v for v in pending if 'qr_code_url' in v]
+        created = set()
+        if uploaded:
+            async with database.write(priority=LOW) as conn:
+                stmt = queries.VENUES_INSERT_MANY
+                created = {
+                    row['id'] for row in await conn.fetch(
+                        stmt,
+                        [v['qr_id'] for v in uploaded],
+                        [v['qr_code_url'] for v in uploaded],
+                        [v['venue_id'] for v in uploaded],
+                        [v['category'] for v in uploaded],
+                        [v['tag'] for v in uploaded],
+                    )
                 }
 
-                return response
+        for venue in uploaded:
+            venue_cache.invalidate(venue['venue_id'])
+            if venue['venue_id'] in created:
+                tag_index.add(venue['tag'], venue['venue_id'], venue['category'], venue['qr_id'])
+            venue['status'] = "created" if venue['venue_id'] in created else "exists"
+
+        report.extend(pending)
+
+    except HTTPException as error:
+        raise error
+    except Exception as error:
+        logger.exception("add_venues_bulk failed")
+        raise HTTPException(500, detail={
+            "error": error.args,
+            "trace": traceback.format_exc()
+        })
+
+    return dict(
+        total=len(rows),
+        counts=count_import(report),
+        venues=report,
+    )
+
+
+async def fetch_venue(id: int) -> dict | None:
+    conn: Connection
+    async with database.read() as conn:
+        stmt = queries.VENUE_DETAIL
+        venue: Venue = await conn.fetchrow(stmt, id, record_class=Venue)
+
+    if venue is None:
+        return None
+
+    return {
+        "id": id,
+        "category": venue['category'],
+        "qr_code": {
+            "id": venue['qr_id'],
+            "url": venue['url'],
+            "image": f"/qrcode/{venue['qr_id']}.png",
+        }
+    }
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return venue_cache.stats()
+
+
+def venue_etag(venue: dict) -> str:
+    digest = sha1(json.dumps(venue, sort_keys=True).encode("utf-8")).hexdigest()
+    return f'"v{venue["id"]}-{digest[:16]}"'
+
+
+@router.get("/{id}")
+async def get_venue(id: int, request: Request):
+    try:
+        venue: dict = await venue_cache.get(id, lambda: fetch_venue(id))
+
+        if venue is None:
+            raise HTTPException(404, detail={
+                "session_id": id,
+                "error": "Resource Not Found",
+                "status": 404,
+            })
+
+        # clients revalidate every time, an unchanged venue costs a 304
+        headers = {"ETag": venue_etag(venue), "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+
+        return JSONResponse(venue, headers=headers)
 
     except HTTPException as error: raise error
     except Exception as error:
-        print(traceback.format_exc())
+        logger.exception("get_venue failed")
         raise HTTPException(500, detail={
             "name": f"{type(error).__class__.__name__}",
             "error": error.args,
             "trace": traceback.format_exc()
-        })
\ No newline at end of file
+        })
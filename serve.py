@@ -0,0 +1,137 @@
+"""
+Production entry point; `python main.py` stays the single-process dev server.
+
+    python serve.py                       # WORKERS processes, one per core by default
+    python serve.py --workers 4 --port 8080
+
+Runs uvicorn with uvloop and httptools and N worker processes. Before
+the workers start it applies migrations once and splits the connection
+budget (DB_MAX_CONNECTIONS, or the server's max_connections minus its
+superuser slots, less DB_CONNECTIONS_RESERVED) evenly over them, so
+workers x DB_POOL_MAX_SIZE never exceeds what Postgres accepts. The
+workers read their pool size from the environment the launcher sets.
+
+On SIGTERM/SIGINT each worker reports draining on /health/ready, stops
+accepting connections, lets in-flight requests finish for up to GRACEFUL_TIMEOUT seconds, then runs
+the lifespan shutdown (flushes pending punches and last_login writes,
+closes the pools). Point the load balancer at /health/ready and the
+process supervisor at /health/live.
+"""
+import argparse
+import asyncio
+import os
+
+import uvicorn
+
+from config import env
+from database import migrate
+from lib.health import health
+from lib.log import logger, logs
+
+
+def drain_on_exit():
+    """
+    Report draining from the first exit signal. uvicorn only runs the
+    lifespan shutdown once open connections have finished, too late for
+    the load balancer to see /health/ready fail while they drain.
+    """
+    handle_exit = uvicorn.Server.handle_exit
+
+    def handle(server: uvicorn.Server, sig: int, frame):
+        health.draining = True
+        try:
+            # streams are ended from the loop, not from inside the signal handler
+            asyncio.get_running_loop().call_soon_threadsafe(health.drain)
+        except RuntimeError:
+            pass
+        handle_exit(server, sig, frame)
+
+    uvicorn.Server.handle_exit = handle
+
+
+# at import, so it also runs in the spawned workers, which import this
+# module as __mp_main__ before their server installs its signal handlers
+drain_on_exit()
+
+
+def available_cores() -> int:
+    # honours CPU affinity/cgroup pinning where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+async def prepare() -> int:
+    """Migrate once for all workers and return the connection budget."""
+    conn = await migrate.connect()
+    try:
+        if env.DB_MIGRATE_ON_STARTUP:
+            await migrate.migrate(conn)
+
+        if env.DB_MAX_CONNECTIONS:
+            total = env.DB_MAX_CONNECTIONS
+        else:
+            total = int(await conn.fetchval("show max_connections"))
+            total -= int(await conn.fetchval("show superuser_reserved_connections"))
+    finally:
+        await conn.close()
+
+    return total - env.DB_CONNECTIONS_RESERVED
+
+
+def pool_settings(workers: int, budget: int) -> dict[str, str]:
+    max_size = min(env.DB_POOL_MAX_SIZE, budget // workers)
+    if max_size < 2:
+        raise SystemExit(f"{budget} connections can't be split over {workers} workers, "
+                         f"lower WORKERS or raise max_connections")
+
+    # keep the HIGH reservation at the same share of the smaller pool
+    reserved = env.DB_POOL_RESERVED_HIGH * max_size // env.DB_POOL_MAX_SIZE
+
+    return dict(
+        DB_POOL_MAX_SIZE=str(max_size),
+        DB_POOL_MIN_SIZE=str(min(env.DB_POOL_MIN_SIZE, max_size)),
+        DB_POOL_RESERVED_HIGH=str(min(max(1, reserved), max_size - 1)),
+        # done above, workers only make sure partitions exist
+        DB_MIGRATE_ON_STARTUP="false",
+    )
+
+
+def main(args):
+    logs.start(env.LOG_LEVEL)
+
+    workers = args.workers or env.WORKERS or available_cores()
+    budget = asyncio.run(prepare())
+    settings = pool_settings(workers, budget)
+
+    # workers are spawned processes and build their settings from this environment
+    os.environ.update(settings)
+    logger.info("starting %d workers, %s connections each of %d",
+                workers, settings['DB_POOL_MAX_SIZE'], budget)
+
+    try:
+        uvicorn.run(
+            "main:app",
+            host=args.host or env.HOST,
+            port=args.port or env.PORT,
+            workers=workers,
+            loop="uvloop",
+            http="httptools",
+            lifespan="on",
+            proxy_headers=True,
+            access_log=env.ACCESS_LOG,
+            timeout_keep_alive=env.KEEPALIVE_TIMEOUT,
+            timeout_graceful_shutdown=env.GRACEFUL_TIMEOUT,
+            # the app's own queue handler takes uvicorn's records too
+            log_config=None,
+        )
+    finally:
+        logs.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    main(parser.parse_args())
@@ -0,0 +1,306 @@
+"""
+Load benchmark for the HTTP API, for before/after comparisons.
+
+    python -m test.async_benchmark --out bench/before.json
+    python -m test.async_benchmark --out bench/after.json --compare bench/before.json
+    python -m test.async_benchmark --url http://127.0.0.1:8080 --database se_bench
+
+Without `--url` the app runs in-process behind httpx's ASGI transport,
+with its lifespan, against a scratch database that is created, migrated
+and dropped by the run, and QR uploads go to the slowed-down local
+storage from test.venue_benchmark. With `--url` requests go to a
+running server; `--database` must then name the database that server
+uses, since the run seeds venues there and deletes what it created
+afterwards.
+
+Scenarios, in order, each with `--concurrency` clients in flight:
+
+    punch_in      lecture start: every user punches in at once
+    report        report reads spread over users, venues and categories
+    punch_out     end of lecture: every session from punch_in is closed
+    venue         venue creation, QR render and upload included
+
+For each scenario the run records throughput, p50/p95/p99/max latency,
+status codes, and the primary pool's acquire wait from `GET /database`
+snapshots taken before, during and after the scenario, and writes them
+all to `--out` as JSON.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from config import env
+from database import migrate, queries
+from lib.qrcode import make_tag, qr_id_of
+from lib.storage import set_storage
+
+FIRST_USER = 900_000_000
+FIRST_VENUE = 900_000
+SCRATCH = "se_benchmark"
+CATEGORIES = ("lecture", "lab", "library", "canteen")
+POOL_POLL_INTERVAL = 0.1
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def pool_wait(client: httpx.AsyncClient) -> dict:
+    response = await client.get("/database")
+    return response.json()['primary']['acquire_wait']
+
+
+async def watch_pool_wait(client: httpx.AsyncClient, before: dict, peaks: list):
+    """Append the mean acquire wait of each POOL_POLL_INTERVAL with acquires in it."""
+    last = before
+    while True:
+        await asyncio.sleep(POOL_POLL_INTERVAL)
+        current = await pool_wait(client)
+        if current['count'] > last['count']:
+            peaks.append((current['total'] - last['total']) / (current['count'] - last['count']))
+        last = current
+
+
+def peak_wait(before: dict, after: dict, peaks: list) -> float:
+    # the server's max is over its whole life: when it rose during the
+    # scenario the new max is the scenario's, otherwise the scenario peak
+    # is at least the busiest poll interval's mean
+    if after['max'] > before['max']:
+        return after['max']
+    return max(peaks, default=0.0)
+
+
+async def drive(client: httpx.AsyncClient, name: str, calls: list, concurrency: int) -> tuple[dict, list]:
+    """Run `calls` (each takes the client, returns a request coroutine) and measure them."""
+    limit = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def one(call):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                response = await call(client)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as error:
+                response = None
+                statuses[type(error).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+            return response
+
+    # count, total and max are cumulative, so the scenario's share is
+    # diffed from snapshots taken before, during and after it
+    before = await pool_wait(client)
+    peaks = []
+    watcher = asyncio.create_task(watch_pool_wait(client, before, peaks))
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(one(call) for call in calls))
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    try:
+        await watcher
+    except asyncio.CancelledError:
+        pass
+    after = await pool_wait(client)
+
+    waits = after['count'] - before['count']
+    result = dict(
+        scenario=name,
+        requests=len(calls),
+        concurrency=concurrency,
+        seconds=round(elapsed, 4),
+        throughput=round(len(calls) / elapsed, 1) if elapsed else 0.0,
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+        max_ms=round(max(latencies, default=0) * 1000, 2),
+        statuses={str(status): count for status, count in statuses.items()},
+        pool_acquires=waits,
+        pool_wait_mean_ms=round((after['total'] - before['total']) / waits * 1000, 3) if waits else 0.0,
+        pool_wait_max_ms=round(peak_wait(before, after, peaks) * 1000, 3),
+    )
+    return result, responses
+
+
+def report(result: dict):
+    print(f"{result['scenario']:>10}: {result['requests']:6} req {result['throughput']:9.1f}/s | "
+          f"p50 {result['p50_ms']:8.1f}  p95 {result['p95_ms']:8.1f}  p99 {result['p99_ms']:8.1f} ms | "
+          f"pool wait {result['pool_wait_mean_ms']:7.2f} ms | {result['statuses']}")
+
+
+def change(new: float, old: float) -> str:
+    return f"{new / old - 1:+7.1%}" if old else "    n/a"
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    before = {result['scenario']: result for result in baseline}
+    print("\nagainst baseline:")
+    for result in results:
+        old = before.get(result['scenario'])
+        if old is None:
+            continue
+        print(f"{result['scenario']:>10}: throughput {change(result['throughput'], old['throughput'])}  "
+              f"p95 {change(result['p95_ms'], old['p95_ms'])}  "
+              f"p99 {change(result['p99_ms'], old['p99_ms'])}")
+
+
+async def run_scenarios(client: httpx.AsyncClient, args) -> list[dict]:
+    users = range(FIRST_USER, FIRST_USER + args.users)
+    venues = range(FIRST_VENUE, FIRST_VENUE + args.venues)
+    results = []
+
+    calls = [
+        lambda c, uid=uid: c.post("/session", data=dict(
+            uid=uid, venue_id=venues[uid % len(venues)], desc="benchmark"))
+        for uid in users
+    ]
+    result, responses = await drive(client, "punch_in", calls, args.concurrency)
+    results.append(result)
+    sessions = [
+        response.json()['id'] for response in responses
+        if response is not None and response.status_code == 200 and 'id' in response.json()
+    ]
+
+    calls = []
+    for i in range(args.reports):
+        if i % 3 == 0:
+            calls.append(lambda c, uid=users[i % len(users)]: c.get(f"/report/user/{uid}"))
+        elif i % 3 == 1:
+            calls.append(lambda c, vid=venues[i % len(venues)]: c.get(f"/report/venue/{vid}"))
+        else:
+            calls.append(lambda c, cat=CATEGORIES[i % len(CATEGORIES)]: c.get(f"/report/category/{cat}"))
+    result, _ = await drive(client, "report", calls, args.concurrency)
+    results.append(result)
+
+    calls = [lambda c, sid=sid: c.put("/session", data=dict(id=sid)) for sid in sessions]
+    result, _ = await drive(client, "punch_out", calls, args.concurrency)
+    results.append(result)
+
+    new_venues = range(FIRST_VENUE + args.venues, FIRST_VENUE + args.venues + args.new_venues)
+    calls = [
+        lambda c, vid=vid: c.post("/venue", data=dict(
+            venue_id=vid, category=CATEGORIES[vid % len(CATEGORIES)]))
+        for vid in new_venues
+    ]
+    result, _ = await drive(client, "venue", calls, args.concurrency)
+    results.append(result)
+
+    for result in results:
+        report(result)
+    return results
+
+
+async def seed(args):
+    venues = list(range(FIRST_VENUE, FIRST_VENUE + args.venues))
+    categories = [CATEGORIES[vid % len(CATEGORIES)] for vid in venues]
+    tags = [make_tag(str(vid), category) for vid, category in zip(venues, categories)]
+    qr_ids = [qr_id_of(tag) for tag in tags]
+
+    conn = await migrate.connect()
+    try:
+        await cleanup(conn, args)
+        await conn.execute(
+            queries.VENUES_INSERT_MANY,
+            qr_ids, [f"file:///benchmark/{tag}.png" for tag in tags], venues, categories, tags,
+        )
+    finally:
+        await conn.close()
+
+
+async def cleanup(conn, args):
+    last_user = FIRST_USER + args.users
+    last_venue = FIRST_VENUE + args.venues + args.new_venues
+    async with conn.transaction():
+        await conn.execute("delete from session where user_id >= $1 and user_id < $2", FIRST_USER, last_user)
+        await conn.execute("delete from user_engagement_daily where user_id >= $1 and user_id < $2",
+                           FIRST_USER, last_user)
+        await conn.execute("delete from venue_engagement_daily where venue_id >= $1 and venue_id < $2",
+                           FIRST_VENUE, last_venue)
+        await conn.execute("""
+            with deleted as (
+                delete from venue where id >= $1 and id < $2 returning qr_id
+            )
+            delete from qr_code where id in (select qr_id from deleted)
+        """, FIRST_VENUE, last_venue)
+
+
+async def in_process(args) -> list[dict]:
+    from main import app
+    from test.venue_benchmark import SlowStorage
+
+    root = Path(tempfile.mkdtemp(prefix="async_benchmark_"))
+    set_storage(SlowStorage(root, args.upload_ms / 1000))
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark",
+                                     timeout=args.timeout) as client:
+            return await run_scenarios(client, args)
+
+
+async def against_server(args) -> list[dict]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await run_scenarios(client, args)
+
+
+async def main(args):
+    scratch = args.url is None and args.database is None
+    if scratch:
+        await migrate.create_scratch_database(SCRATCH)
+    env.DB_NAME = SCRATCH if scratch else args.database or env.DB_NAME
+
+    try:
+        await seed(args)
+        results = await (in_process(args) if args.url is None else against_server(args))
+
+    finally:
+        if scratch:
+            await migrate.drop_scratch_database(SCRATCH)
+        else:
+            conn = await migrate.connect()
+            try:
+                await cleanup(conn, args)
+            finally:
+                await conn.close()
+
+    output = dict(
+        started=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        target=args.url or "in-process",
+        ingest=env.PUNCH_INGEST_MODE,
+        pool_max_size=env.DB_POOL_MAX_SIZE,
+        users=args.users,
+        venues=args.venues,
+        results=results,
+    )
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(output, indent=2))
+        print(f"\nwrote {args.out}")
+
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text())['results'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--database", help="database to seed; default is a scratch database")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--venues", type=int, default=40)
+    parser.add_argument("--reports", type=int, default=2000)
+    parser.add_argument("--new-venues", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--upload-ms", type=float, default=80)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--out", default="bench/latest.json")
+    parser.add_argument("--compare", metavar="JSON")
+    asyncio.run(main(parser.parse_args()))
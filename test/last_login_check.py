@@ -0,0 +1,83 @@
+"""
+LastLoginWriter shutdown: stopping the writer while a flush is in flight
+must neither lose the logins that flush took nor the ones recorded while
+it ran, and a cancelled flush must put its logins back.
+
+    python -m test.last_login_check
+
+The database is replaced by a fake whose UPDATE takes `--delay` seconds.
+"""
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import lib.last_login
+from lib.last_login import LastLoginWriter
+
+
+class SlowDatabase:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.written: dict[int, datetime] = {}
+        self.executing = asyncio.Event()
+
+    @asynccontextmanager
+    async def write(self, priority: str):
+        yield self
+
+    async def execute(self, query: str, user_ids: list[int], dates: list[datetime]):
+        self.executing.set()
+        await asyncio.sleep(self.delay)
+        self.written.update(zip(user_ids, dates))
+
+
+async def stop_during_flush(args):
+    fake = lib.last_login.database = SlowDatabase(args.delay)
+    writer = LastLoginWriter(interval=0.01)
+    await writer.start()
+
+    writer.record(1, datetime(2024, 1, 1))
+    await fake.executing.wait()
+    # recorded after the running flush took its batch
+    writer.record(2, datetime(2024, 1, 2))
+    await writer.stop()
+
+    assert fake.written == {1: datetime(2024, 1, 1), 2: datetime(2024, 1, 2)}, fake.written
+    assert not writer.pending, writer.pending
+    print("stop during flush: both logins written")
+
+
+async def cancel_during_flush(args):
+    fake = lib.last_login.database = SlowDatabase(args.delay)
+    writer = LastLoginWriter(interval=60)
+
+    writer.record(1, datetime(2024, 1, 1))
+    task = asyncio.create_task(writer.flush())
+    await fake.executing.wait()
+    writer.record(1, datetime(2024, 1, 3))
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+    # the newer login wins over the one the cancelled flush gives back
+    assert writer.pending == {1: datetime(2024, 1, 3)}, writer.pending
+    assert not fake.written, fake.written
+    print("cancelled flush: login kept for the next flush")
+
+
+async def main(args):
+    database = lib.last_login.database
+    try:
+        await stop_during_flush(args)
+        await cancel_during_flush(args)
+    finally:
+        lib.last_login.database = database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delay", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+"""
+Punch-in storm: per-request transactions vs. the batched ingest pipeline.
+
+    python -m test.punch_benchmark --venue 101 --users 500
+
+Needs the database from `.env` and an existing venue. Sessions created by
+the run are deleted afterwards.
+"""
+import argparse
+import asyncio
+import time
+
+from database.db import database
+from lib.ingest import PunchBatcher
+from routes.session import register_session
+
+FIRST_USER = 900_000_000
+
+
+async def direct(users: list[int], venue_id: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(register_session(uid, venue_id, "benchmark") for uid in users))
+    return time.perf_counter() - start
+
+
+async def batched(users: list[int], venue_id: int, batcher: PunchBatcher) -> float:
+    await batcher.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(batcher.punch_in(uid, venue_id, "benchmark") for uid in users))
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+    return elapsed
+
+
+async def cleanup(users: list[int]):
+    async with database.pool.acquire() as conn:
+        await conn.execute("delete from session where user_id = any($1::int[])", users)
+
+
+def report(name: str, elapsed: float, count: int, commits: int):
+    print(f"{name:>8}: {count} punches in {elapsed * 1000:8.1f} ms "
+          f"({count / elapsed:8.0f}/s), {commits} commits")
+
+
+async def main(args):
+    await database.connect()
+    users = list(range(FIRST_USER, FIRST_USER + args.users))
+
+    try:
+        await cleanup(users)
+
+        elapsed = await direct(users, args.venue)
+        report("direct", elapsed, len(users), len(users))
+        await cleanup(users)
+
+        batcher = PunchBatcher(batch_size=args.batch_size, delay=args.delay_ms / 1000)
+        elapsed = await batched(users, args.venue, batcher)
+        report("batched", elapsed, len(users), batcher.flushes)
+
+    finally:
+        await cleanup(users)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--venue", type=int, required=True)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+"""
+Rollup rebuild against a held lock: while another connection holds a lock
+on the engagement tables, `POST /report/rebuild` has to give up after
+ROLLUP_LOCK_TIMEOUT with a 503 and Retry-After instead of queuing every
+punch-out behind its lock request.
+
+    python -m test.rollup_lock_check --lock-timeout 0.5
+
+Runs against a scratch database that is created, migrated and dropped.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import HTTPException
+
+from config import env
+from database import migrate
+from database.db import database
+from lib.rollup import rollup
+from routes.report import rebuild_report
+
+SCRATCH = "rollup_lock_check"
+
+
+async def check(args):
+    holder = await migrate.connect()
+    try:
+        transaction = holder.transaction()
+        await transaction.start()
+        # a punch-out in flight holds row exclusive on the user table
+        await holder.execute("lock table user_engagement_daily in row exclusive mode")
+
+        start = time.perf_counter()
+        try:
+            await rebuild_report()
+        except HTTPException as error:
+            elapsed = time.perf_counter() - start
+            assert error.status_code == 503, error.status_code
+            assert error.headers == {"Retry-After": str(env.DB_RETRY_AFTER)}, error.headers
+            assert elapsed < args.lock_timeout + 2, elapsed
+            print(f"held lock: 503 after {elapsed:.2f}s")
+        else:
+            raise AssertionError("rebuild finished while the lock was held")
+
+        await transaction.rollback()
+    finally:
+        await holder.close()
+
+    rows = await rebuild_report()
+    print(f"released lock: {rows}")
+
+
+async def main(args):
+    await migrate.create_scratch_database(SCRATCH)
+    env.DB_NAME = SCRATCH
+    rollup.lock_timeout = args.lock_timeout
+
+    try:
+        await database.connect()
+        try:
+            await check(args)
+        finally:
+            await database.disconnect()
+    finally:
+        await migrate.drop_scratch_database(SCRATCH)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lock-timeout", type=float, default=0.5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,78 @@
+"""
+Pool saturation: slow LOW reads flood the primary while HIGH work keeps
+arriving, to check that punches still get connections and that excess
+LOW work is shed with `Overloaded` instead of queuing.
+
+    python -m test.saturation_benchmark --low 2000 --high 200 --sleep 0.2
+
+Needs the database from `.env`; nothing is written.
+"""
+import argparse
+import asyncio
+import time
+
+from database.db import HIGH, LOW, Overloaded, database
+
+
+async def query(priority: str, sleep: float, results: dict):
+    start = time.perf_counter()
+    try:
+        if priority == HIGH:
+            cm = database.write(priority=HIGH)
+        else:
+            cm = database.read(priority=LOW)
+
+        async with cm as conn:
+            await conn.execute("select pg_sleep($1)", sleep)
+        results[priority]['ok'].append(time.perf_counter() - start)
+
+    except Overloaded:
+        results[priority]['shed'].append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(priority: str, result: dict):
+    ok, shed = result['ok'], result['shed']
+    print(f"{priority:>5}: {len(ok):6} ok  p50 {percentile(ok, 0.5) * 1000:8.1f} ms  "
+          f"p95 {percentile(ok, 0.95) * 1000:8.1f} ms | {len(shed):6} shed  "
+          f"p95 {percentile(shed, 0.95) * 1000:8.1f} ms")
+
+
+async def main(args):
+    await database.connect()
+    results = {priority: dict(ok=[], shed=[]) for priority in (HIGH, LOW)}
+
+    try:
+        low = [
+            asyncio.create_task(query(LOW, args.sleep, results))
+            for _ in range(args.low)
+        ]
+        # HIGH work trickles in while the LOW flood holds the pool
+        high = []
+        for _ in range(args.high):
+            high.append(asyncio.create_task(query(HIGH, args.sleep / 10, results)))
+            await asyncio.sleep(args.interval)
+
+        await asyncio.gather(*low, *high)
+
+        report(HIGH, results[HIGH])
+        report(LOW, results[LOW])
+        print(database.stats())
+
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--low", type=int, default=2000)
+    parser.add_argument("--high", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.2)
+    parser.add_argument("--interval", type=float, default=0.005)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,120 @@
+"""
+Concurrent venue creation: latency and event-loop stalls.
+
+    python -m test.venue_benchmark --venues 100 --upload-ms 80
+
+Uploads go to the local storage backend, slowed down by `--upload-ms`
+per object to mimic a network round trip. The `inline` run does
+rendering and upload on the event loop inside the transaction, the way
+add_new_venue used to; `offloaded` runs the current handler. Venues created by the run are deleted afterwards.
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from hashlib import sha1
+from io import BytesIO
+from pathlib import Path
+
+from database.db import database
+from lib.qrcode import generate_qr_code
+from lib.storage import LocalStorage, set_storage
+from routes.venue import add_new_venue
+
+FIRST_VENUE = 900_000
+
+
+class SlowStorage(LocalStorage):
+    """Local-directory storage that sleeps per object like a network round trip."""
+
+    def __init__(self, root: Path, delay: float):
+        super().__init__(str(root))
+        self.delay = delay
+
+    def put(self, name: str, file: BytesIO, content_type: str) -> str:
+        time.sleep(self.delay)
+        return super().put(name, file, content_type)
+
+
+async def heartbeat(stalls: list, interval: float = 0.005):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stalls.append(loop.time() - start - interval)
+
+
+async def inline_create(venue_id: int, category: str, storage: SlowStorage):
+    async with database.pool.acquire() as conn:
+        async with conn.transaction():
+            img, tag = generate_qr_code(str(venue_id), category)
+            qr_id = sha1(tag.encode("utf-8")).hexdigest()
+
+            url = storage.put(f"{qr_id}.png", img, "image/png")
+
+            await conn.execute("insert into qr_code values($1, $2);", qr_id, url)
+            await conn.execute(
+                "insert into venue(id, qr_id, category) values($1, $2, $3);",
+                venue_id, qr_id, category,
+            )
+
+
+async def offloaded_create(venue_id: int, category: str, storage: SlowStorage):
+    await add_new_venue(str(venue_id), category)
+
+
+async def run(name: str, create, venues: list[int], storage: SlowStorage):
+    latencies, stalls = [], []
+
+    async def timed(venue_id: int):
+        start = time.perf_counter()
+        await create(venue_id, "benchmark", storage)
+        latencies.append(time.perf_counter() - start)
+
+    beat = asyncio.create_task(heartbeat(stalls))
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(venue_id) for venue_id in venues))
+    elapsed = time.perf_counter() - start
+    beat.cancel()
+
+    latencies.sort()
+    print(f"{name:>10}: {len(venues)} venues in {elapsed * 1000:8.1f} ms | "
+          f"p50 {statistics.median(latencies) * 1000:7.1f} ms "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms | "
+          f"max loop stall {max(stalls, default=0) * 1000:7.1f} ms")
+
+
+async def cleanup(venues: list[int]):
+    async with database.pool.acquire() as conn:
+        await conn.execute("""
+            with deleted as (
+                delete from venue where id = any($1::int[]) returning qr_id
+            )
+            delete from qr_code where id in (select qr_id from deleted)
+        """, venues)
+
+
+async def main(args):
+    root = Path(tempfile.mkdtemp(prefix="venue_benchmark_"))
+    storage = SlowStorage(root, args.upload_ms / 1000)
+    set_storage(storage)
+
+    await database.connect()
+    venues = list(range(FIRST_VENUE, FIRST_VENUE + args.venues))
+
+    try:
+        await cleanup(venues)
+        await run("inline", inline_create, venues, storage)
+        await cleanup(venues)
+        await run("offloaded", offloaded_create, venues, storage)
+    finally:
+        await cleanup(venues)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--venues", type=int, default=100)
+    parser.add_argument("--upload-ms", type=float, default=80)
+    asyncio.run(main(parser.parse_args()))
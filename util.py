@@ -1,11 +1,99 @@
+import base64
+import csv
 import datetime
+import io
+
+from fastapi import Request
+
+from lib.log import logger
+
+INT_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
 
 
 def log(route: str, error):
-    print(f"<=== exception in {route} ===> ")
-    print(error)
-    print(f"<=== exception in {route} ===> ")
+    logger.error("exception in %s", route, exc_info=error)
 
 def get_date(x: int) -> datetime.date:
     x /= 1000
-    return datetime.date.fromtimestamp(x)
\ No newline at end of file
+    return datetime.date.fromtimestamp(x)
+
+def get_datetime(x: int) -> datetime.datetime:
+    x /= 1000
+    return datetime.datetime.fromtimestamp(x)
+
+def get_range(span: str, x: int | None = None) -> tuple[datetime.date, datetime.date]:
+    """
+    Resolve a report span around the day of timestamp `x` (ms, today when
+    omitted) into a [start, end) date range. Semesters run Jan-Jun and Jul-Dec.
+    """
+    day = get_date(x) if x is not None else datetime.date.today()
+
+    if span == "day":
+        return day, day + datetime.timedelta(days=1)
+
+    if span == "week":
+        start = day - datetime.timedelta(days=day.weekday())
+        return start, start + datetime.timedelta(days=7)
+
+    if span == "semester":
+        if day.month <= 6:
+            return datetime.date(day.year, 1, 1), datetime.date(day.year, 7, 1)
+        return datetime.date(day.year, 7, 1), datetime.date(day.year + 1, 1, 1)
+
+    raise ValueError(f"unknown span {span}")
+
+
+def encode_cursor(punch_in_time: datetime.datetime, id: int) -> str:
+    raw = f"{punch_in_time.isoformat()}|{id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(token: str) -> tuple[datetime.datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+        punch_in_time, id = raw.split("|")
+        return datetime.datetime.fromisoformat(punch_in_time), int(id)
+    except Exception as error:
+        raise ValueError(f"invalid cursor {token}") from error
+
+def encode_sync_cursor(horizon: int, after: tuple[int, int] | None = None) -> str:
+    raw = f"{horizon}|{after[0]}|{after[1]}" if after is not None else f"{horizon}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_sync_cursor(token: str) -> tuple[int, tuple[int, int] | None]:
+    try:
+        raw = base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+        horizon, *after = (int(part) for part in raw.split("|"))
+        if after and len(after) != 2:
+            raise ValueError(raw)
+        return horizon, tuple(after) if after else None
+    except Exception as error:
+        raise ValueError(f"invalid cursor {token}") from error
+
+async def read_import(request: Request, key: str) -> list[dict]:
+    """Rows of an uploaded CSV (raw body or multipart `file`) or of a JSON list / {key: [...]}."""
+    content_type = request.headers.get("content-type", "")
+
+    if "json" in content_type:
+        data = await request.json()
+        return data if isinstance(data, list) else data.get(key, [])
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        raw = (await form["file"].read()).decode("utf-8-sig")
+    else:
+        raw = (await request.body()).decode("utf-8-sig")
+
+    return list(csv.DictReader(io.StringIO(raw)))
+
+def is_number(value: str, maximum: int) -> bool:
+    # isdigit() alone takes characters like "²" that int() rejects
+    return value.isascii() and value.isdigit() and int(value) <= maximum
+
+def count_import(report: list[dict]) -> dict[str, int]:
+    """Sort an import report by row and count its rows per status."""
+    report.sort(key=lambda r: r['row'])
+    counts = {}
+    for row in report:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    return counts